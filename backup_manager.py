@@ -7,11 +7,14 @@ Backup management script for Birthday Reminder Bot
 """
 
 import os
-import shutil
+import sqlite3
+import time
 from datetime import datetime
 from pathlib import Path
 import logging
 
+import metrics
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -40,7 +43,7 @@ class BackupManager:
             True if successful, False otherwise
         """
         if not os.path.exists(self.db_path):
-            logger.warning(f"Database not found: {self.db_path}")
+            logger.warning("Database not found: %s", self.db_path)
             return False
         
         # Determine backup directory and filename
@@ -54,25 +57,39 @@ class BackupManager:
             backup_dir = self.yearly_dir
             timestamp_format = '%Y'  # Year precision
         else:
-            logger.error(f"Unknown backup type: {backup_type}")
+            logger.error("Unknown backup type: %s", backup_type)
             return False
         
+        started = time.perf_counter()
         try:
             timestamp = datetime.now().strftime(timestamp_format)
             backup_filename = f"birthday_bot_{backup_type}_{timestamp}.db"
             backup_path = os.path.join(backup_dir, backup_filename)
             
-            # Copy database file
-            shutil.copy2(self.db_path, backup_path)
-            logger.info(f"Created {backup_type} backup: {backup_filename}")
+            # Use the SQLite online backup API: a plain file copy would miss
+            # pages still sitting in the -wal file when WAL mode is enabled
+            source = sqlite3.connect(self.db_path)
+            try:
+                target = sqlite3.connect(backup_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            logger.info("Created %s backup: %s", backup_type, backup_filename)
             
             # Clean old backups based on type
             self._cleanup_old_backups(backup_dir, backup_type)
             
+            metrics.BACKUPS.labels(backup_type, "success").inc()
             return True
         except Exception as e:
-            logger.error(f"Error creating {backup_type} backup: {e}")
+            logger.error("Error creating %s backup: %s", backup_type, e)
+            metrics.BACKUPS.labels(backup_type, "failure").inc()
             return False
+        finally:
+            metrics.BACKUP_DURATION.labels(backup_type).observe(time.perf_counter() - started)
     
     def _cleanup_old_backups(self, backup_dir: str, backup_type: str) -> None:
         """Remove old backups based on retention policy"""
@@ -96,9 +113,9 @@ class BackupManager:
                 for backup in backups[:to_delete]:
                     backup_path = os.path.join(backup_dir, backup)
                     os.remove(backup_path)
-                    logger.info(f"Deleted old {backup_type} backup: {backup}")
+                    logger.info("Deleted old %s backup: %s", backup_type, backup)
         except Exception as e:
-            logger.error(f"Error cleaning old backups: {e}")
+            logger.error("Error cleaning old backups: %s", e)
     
     def get_backup_size(self) -> dict:
         """Get total size of backups by type"""
@@ -139,6 +156,11 @@ def main():
         size_mb = size / (1024 * 1024)
         print(f"  {btype}: {size_mb:.2f} MB")
     
+    # Cron runs are separate processes: hand metrics to node_exporter's textfile collector
+    textfile = os.getenv("METRICS_TEXTFILE")
+    if textfile:
+        metrics.REGISTRY.write_textfile(textfile)
+    
     sys.exit(0 if success else 1)
 
 
@@ -0,0 +1 @@
+"""Benchmarks for Birthday Reminder Bot (run with `python -m benchmarks.<name>`)"""
@@ -0,0 +1,69 @@
+"""
+Table-driven calendar vs. the per-row datetime loop it replaced
+
+Times "days until birthday" for a chat-sized list of (day, month) pairs.
+The legacy implementation raises ValueError for 29.02 in non-leap years, so
+the pairs exclude 29.02 unless --with-feb29 is given (then the legacy
+column counts failures instead).
+
+Usage:
+    python -m benchmarks.calendar_engine --rows 200000
+"""
+
+import argparse
+import calendar
+import random
+import time
+from datetime import date, datetime
+
+from birthday_calendar import DaysUntilTable
+
+
+def legacy_days_until(day: int, month: int, today: date) -> int:
+    """Previous utils.get_days_until_birthday, with the clock read hoisted out"""
+    this_year_birthday = datetime(today.year, month, day).date()
+    if this_year_birthday >= today:
+        return (this_year_birthday - today).days
+    next_year_birthday = datetime(today.year + 1, month, day).date()
+    return (next_year_birthday - today).days
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the calendar engine")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--with-feb29", action="store_true")
+    parser.add_argument("--date", default="2025-10-19", help="Reference date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    on = date.fromisoformat(args.date)
+    rng = random.Random(1)
+    all_dates = [(d, m) for m in range(1, 13) for d in range(1, calendar.monthrange(2024, m)[1] + 1)]
+    if not args.with_feb29:
+        all_dates.remove((29, 2))
+    pairs = [rng.choice(all_dates) for _ in range(args.rows)]
+
+    start = time.perf_counter()
+    failures = 0
+    legacy = []
+    for day, month in pairs:
+        try:
+            legacy.append(legacy_days_until(day, month, on))
+        except ValueError:
+            failures += 1
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = DaysUntilTable(on)
+    fast = table.days_until_many(pairs)
+    table_seconds = time.perf_counter() - start
+
+    if not failures:
+        assert legacy == fast, "table results differ from the legacy loop"
+    print(f"rows: {args.rows}, reference date: {on}")
+    print(f"legacy datetime loop: {legacy_seconds * 1000:9.1f} ms  ({failures} ValueErrors)")
+    print(f"table lookup:         {table_seconds * 1000:9.1f} ms  (incl. building the table)")
+    print(f"speedup: x{legacy_seconds / table_seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
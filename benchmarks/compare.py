@@ -0,0 +1,50 @@
+"""
+Compare two benchmark result files written by benchmarks.service_suite
+
+Exits with status 1 when any benchmark's median got slower than --threshold.
+
+Usage:
+    python -m benchmarks.compare results/base.json results/head.json --threshold 1.2
+"""
+
+import argparse
+import json
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio treated as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline {baseline['commit']}  vs  candidate {candidate['commit']}")
+    regressions = 0
+    for name, stats in candidate["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<40} {'new':>10}")
+            continue
+        if "error" in stats:
+            regressions += "error" not in base
+            print(f"{name:<40} ERROR {stats['error']}")
+            continue
+        if "error" in base:
+            print(f"{name:<40} fixed -> {stats['median_ms']:>9.3f} ms")
+            continue
+        ratio = stats["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        flag = "  REGRESSION" if ratio > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{name:<40} {base['median_ms']:>9.3f} -> {stats['median_ms']:>9.3f} ms  x{ratio:.2f}{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Synthetic population generator for benchmarks
+
+Chat sizes follow a Pareto (power-law) distribution: most chats are small,
+a few are huge (up to --max-members). Birthdays are spread over all 366
+days including 29.02, which occurs about a quarter as often as other days.
+Generation is seeded, so the same arguments always produce the same data.
+
+Usage:
+    python -m benchmarks.datagen --url sqlite:///bench.db --chats 10000 --max-members 200000
+    python -m benchmarks.datagen --url sqlite:///legacy.db --schema legacy
+"""
+
+import argparse
+import calendar
+import random
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import insert
+
+from database import Base, Membership, User, UserBirthday, create_db_engine
+
+# Every (day, month) of a leap year with its relative weight
+_DATES: List[Tuple[int, int]] = [
+    (day, month) for month in range(1, 13) for day in range(1, calendar.monthrange(2024, month)[1] + 1)
+]
+_WEIGHTS: List[float] = [0.25 if date == (29, 2) else 1.0 for date in _DATES]
+
+
+@dataclass
+class Population:
+    """Parameters of a generated population"""
+    chats: int = 1000
+    max_members: int = 20000
+    users: int = 200000
+    pareto_alpha: float = 1.2
+    seed: int = 42
+
+
+def chat_sizes(population: Population) -> List[int]:
+    """Skewed member counts, one per chat (largest chat first)"""
+    rng = random.Random(population.seed)
+    sizes = [min(population.max_members, max(1, int(rng.paretovariate(population.pareto_alpha) * 3)))
+             for _ in range(population.chats)]
+    # Always include one chat of the maximum size so the tail is exercised
+    if sizes:
+        sizes[0] = population.max_members
+    return sorted(sizes, reverse=True)
+
+
+def generate_memberships(population: Population) -> Iterator[Tuple[int, int]]:
+    """Yield (user_id, chat_id) pairs for the population"""
+    rng = random.Random(population.seed + 1)
+    user_count = max(population.users, population.max_members)
+
+    for chat_index, size in enumerate(chat_sizes(population)):
+        chat_id = -1000000000000 - chat_index
+        for user_index in rng.sample(range(user_count), size):
+            yield user_index + 1, chat_id
+
+
+def user_birthdays(population: Population) -> List[Tuple[int, int]]:
+    """(day, month) of every user; index 0 belongs to user_id 1"""
+    rng = random.Random(population.seed + 2)
+    return rng.choices(_DATES, weights=_WEIGHTS, k=max(population.users, population.max_members))
+
+
+def populate(url: str, population: Population, profile: str = "throughput", batch_size: int = 10000,
+             schema: str = "normalized", bot_id: int = 0) -> int:
+    """
+    Recreate the schema and load a population
+
+    Args:
+        schema: "normalized" (users + memberships) or "legacy" (user_birthdays)
+        bot_id: Bot the memberships belong to (normalized schema only)
+
+    Returns:
+        Number of (user, chat) registrations inserted
+    """
+    engine = create_db_engine(url, profile)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    birthdays = user_birthdays(population)
+
+    total = 0
+    seen_users = set()
+    batch, users = [], []
+    target = Membership if schema == "normalized" else UserBirthday
+
+    def flush(conn):
+        if users:
+            conn.execute(insert(User), users)
+            users.clear()
+        if batch:
+            conn.execute(insert(target), batch)
+            batch.clear()
+
+    with engine.begin() as conn:
+        for user_id, chat_id in generate_memberships(population):
+            day, month = birthdays[user_id - 1]
+            if schema == "normalized":
+                if user_id not in seen_users:
+                    seen_users.add(user_id)
+                    users.append({"user_id": user_id, "username": f"user{user_id}", "day": day, "month": month})
+                batch.append({"bot_id": bot_id, "user_id": user_id, "chat_id": chat_id, "opt_in": True})
+            else:
+                batch.append({"user_id": user_id, "chat_id": chat_id, "username": f"user{user_id}",
+                              "day": day, "month": month})
+            total += 1
+            if len(batch) >= batch_size:
+                flush(conn)
+        flush(conn)
+    engine.dispose()
+    return total
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Population arguments shared with the benchmark runner"""
+    defaults = Population()
+    parser.add_argument("--chats", type=int, default=defaults.chats)
+    parser.add_argument("--max-members", type=int, default=defaults.max_members)
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def population_from_args(args) -> Population:
+    return Population(chats=args.chats, max_members=args.max_members, users=args.users, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic birthday population")
+    parser.add_argument("--url", required=True, help="Target database URL (its tables are recreated)")
+    parser.add_argument("--schema", choices=["normalized", "legacy"], default="normalized")
+    parser.add_argument("--bot-id", type=int, default=0, help="Bot the memberships belong to")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = populate(args.url, population_from_args(args), schema=args.schema, bot_id=args.bot_id)
+    print(f"Inserted {rows} registrations in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Local stand-in for the Telegram Bot API
+
+Implements just enough of the API for main.py to run against it:
+getMe, getUpdates (long polling), setWebhook/deleteWebhook, sendMessage,
+editMessageText, answerCallbackQuery, getChatMember and deleteMessage.
+Outbound calls can be slowed down and can fail with 429 (RetryAfter) or
+403 (Forbidden) at configurable rates.
+
+Point the bot at it with TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot
+
+Usage (standalone, for manual testing):
+    python -m benchmarks.fake_bot_api --port 8081 --latency-ms 50 --rate-429 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 123456,
+    "is_bot": True,
+    "first_name": "FakeBot",
+    "username": "fake_birthday_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+# Methods that act on chats; only these get latency and injected errors
+OUTBOUND_METHODS = {"sendMessage", "editMessageText", "answerCallbackQuery", "getChatMember", "deleteMessage"}
+
+
+@dataclass
+class FaultConfig:
+    """Latency and error injection for outbound methods"""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    rate_429: float = 0.0
+    retry_after: int = 1
+    rate_403: float = 0.0
+    seed: int = 0
+
+
+class FakeBotAPI:
+    """In-process fake Bot API server"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, faults: Optional[FaultConfig] = None):
+        self.host = host
+        self.port = port
+        self.faults = faults or FaultConfig()
+        self._rng = random.Random(self.faults.seed)
+        self._server = None
+        self._updates: List[dict] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._updates_available = asyncio.Event()
+        self.webhook_url = ""
+        self.messages: Dict[tuple, dict] = {}
+        self.call_counts: Dict[str, int] = {}
+        self.polling_started = asyncio.Event()
+        self._connections = set()
+        # Called as on_call(method, params, result) after every outbound call (result is None on injected errors)
+        self.on_call: Optional[Callable[[str, dict, object], None]] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        logger.info("Fake Bot API listening on %s", self.base_url)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Release pending long polls so connection handlers can finish
+            self._updates_available.set()
+            if self._connections:
+                await asyncio.wait(self._connections, timeout=5)
+            await self._server.wait_closed()
+            self._server = None
+
+    # Update injection
+
+    def next_message_id(self) -> int:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    def push_update(self, update: dict) -> int:
+        """Queue an update for getUpdates; returns its update_id"""
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(dict(update, update_id=update_id))
+        self._updates_available.set()
+        return update_id
+
+    # HTTP
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+
+                path = request_line.decode("latin-1").split()[1]
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                params = self._parse_body(headers.get("content-type", ""), body)
+                status, payload = await self._dispatch(method, params)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse_body(content_type: str, body: bytes) -> dict:
+        if not body:
+            return {}
+        if "application/json" in content_type:
+            return json.loads(body)
+        # python-telegram-bot sends form fields whose values are JSON encoded (except plain strings)
+        params = {}
+        for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+            if key == "text":
+                params[key] = value
+                continue
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def _dispatch(self, method: str, params: dict):
+        self.call_counts[method] = self.call_counts.get(method, 0) + 1
+
+        if method in OUTBOUND_METHODS:
+            faults = self.faults
+            if faults.latency_ms or faults.jitter_ms:
+                await asyncio.sleep((faults.latency_ms + self._rng.uniform(0, faults.jitter_ms)) / 1000)
+            roll = self._rng.random()
+            if roll < faults.rate_429 + faults.rate_403 and self.on_call is not None:
+                self.on_call(method, params, None)
+            if roll < faults.rate_429:
+                return "429 Too Many Requests", {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {faults.retry_after}",
+                    "parameters": {"retry_after": faults.retry_after},
+                }
+            if roll < faults.rate_429 + faults.rate_403:
+                return "403 Forbidden", {
+                    "ok": False, "error_code": 403,
+                    "description": "Forbidden: bot was kicked from the group chat",
+                }
+
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return "404 Not Found", {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        result = await handler(params)
+        if method in OUTBOUND_METHODS and self.on_call is not None:
+            self.on_call(method, params, result)
+        return "200 OK", {"ok": True, "result": result}
+
+    # API methods
+
+    async def _api_getMe(self, params: dict):
+        return BOT_USER
+
+    async def _api_setWebhook(self, params: dict):
+        self.webhook_url = params.get("url", "")
+        return True
+
+    async def _api_deleteWebhook(self, params: dict):
+        self.webhook_url = ""
+        return True
+
+    async def _api_getUpdates(self, params: dict):
+        self.polling_started.set()
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    def _chat(self, chat_id: int) -> dict:
+        return {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"}
+
+    async def _api_sendMessage(self, params: dict):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self.messages[(chat_id, message["message_id"])] = message
+        return message
+
+    async def _api_editMessageText(self, params: dict):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        message = dict(self.messages.get(key) or {
+            "message_id": key[1], "date": int(time.time()), "chat": self._chat(key[0]), "from": BOT_USER,
+        })
+        message["text"] = params.get("text", "")
+        message.pop("reply_markup", None)
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self.messages[key] = message
+        return message
+
+    async def _api_answerCallbackQuery(self, params: dict):
+        return True
+
+    async def _api_getChatMember(self, params: dict):
+        return {
+            "status": "creator",
+            "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"},
+            "is_anonymous": False,
+        }
+
+    async def _api_deleteMessage(self, params: dict):
+        self.messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-403", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    faults = FaultConfig(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, args.rate_403)
+
+    async def run():
+        server = FakeBotAPI(args.host, args.port, faults)
+        await server.start()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+End-to-end load test of main.py against the fake Bot API
+
+Starts benchmarks.fake_bot_api, launches main.py pointed at it with a fresh
+SQLite database and replays simulated users. Each user runs
+/setbirthday -> day button -> month button -> /nextbirthdays; a share of the
+users join their chat first (new_chat_members). Latency is measured from
+injecting an update to the bot's first API call answering it.
+
+Usage:
+    python -m benchmarks.loadtest --users 2000 --chats 50 --concurrency 200
+    python -m benchmarks.loadtest --users 500 --latency-ms 80 --rate-429 0.01 --rate-403 0.005
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.fake_bot_api import FakeBotAPI, FaultConfig
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:LOADTEST"
+
+
+class StepFailed(Exception):
+    """The bot did not answer a step, or its answer was rejected by the fake API"""
+
+
+class LoadDriver:
+    """Injects updates and matches them with the bot's answers"""
+
+    def __init__(self, api: FakeBotAPI, step_timeout: float):
+        self.api = api
+        self.step_timeout = step_timeout
+        self.latencies: Dict[str, List[float]] = {}
+        self.timeouts = 0
+        self.rejected = 0
+        self.updates_sent = 0
+        self._waiters: Dict[tuple, asyncio.Future] = {}
+        self._next_callback_id = 1
+        api.on_call = self._on_call
+
+    def _on_call(self, method: str, params: dict, result) -> None:
+        if method == "sendMessage":
+            reply_to = params.get("reply_to_message_id") or (params.get("reply_parameters") or {}).get("message_id")
+            key = ("reply", int(params["chat_id"]), int(reply_to or 0))
+        elif method == "answerCallbackQuery":
+            key = ("callback", str(params["callback_query_id"]))
+        elif method == "editMessageText":
+            key = ("edit", int(params["chat_id"]), int(params["message_id"]))
+        else:
+            return
+        future = self._waiters.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def _send(self, step: str, update: dict, key: tuple):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[key] = future
+        started = time.perf_counter()
+        self.api.push_update(update)
+        self.updates_sent += 1
+        try:
+            result = await asyncio.wait_for(future, self.step_timeout)
+        except asyncio.TimeoutError:
+            self._waiters.pop(key, None)
+            self.timeouts += 1
+            raise StepFailed(step)
+        if result is None:
+            self.rejected += 1
+            raise StepFailed(step)
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+        return result
+
+    def _message(self, chat_id: int, user: dict, **fields) -> dict:
+        message = {
+            "message_id": self.api.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"},
+            "from": user,
+        }
+        message.update(fields)
+        return message
+
+    async def command(self, step: str, chat_id: int, user: dict, command: str):
+        message = self._message(chat_id, user, text=command,
+                                entities=[{"type": "bot_command", "offset": 0, "length": len(command)}])
+        return await self._send(step, {"message": message}, ("reply", chat_id, message["message_id"]))
+
+    async def join(self, chat_id: int, user: dict):
+        message = self._message(chat_id, user, new_chat_members=[user])
+        return await self._send("join", {"message": message}, ("reply", chat_id, message["message_id"]))
+
+    async def press(self, step: str, user: dict, bot_message: dict, data: str, wait_for_edit: bool = True):
+        callback_id = str(self._next_callback_id)
+        self._next_callback_id += 1
+        update = {"callback_query": {
+            "id": callback_id, "from": user, "chat_instance": "load", "data": data, "message": bot_message,
+        }}
+        chat_id = bot_message["chat"]["id"]
+        edit_key = ("edit", chat_id, bot_message["message_id"])
+        edit = asyncio.get_running_loop().create_future()
+        if wait_for_edit:
+            self._waiters[edit_key] = edit
+        await self._send(step, update, ("callback", callback_id))
+        if wait_for_edit:
+            try:
+                edited = await asyncio.wait_for(edit, self.step_timeout)
+            except asyncio.TimeoutError:
+                self._waiters.pop(edit_key, None)
+                self.timeouts += 1
+                raise StepFailed(f"{step} edit")
+            if edited is None:
+                self.rejected += 1
+                raise StepFailed(f"{step} edit")
+            return edited
+        return bot_message
+
+    async def user_flow(self, user_id: int, chat_id: int, join_first: bool, rng: random.Random) -> None:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        try:
+            if join_first:
+                await self.join(chat_id, user)
+            keyboard = await self.command("setbirthday", chat_id, user, "/setbirthday")
+            after_day = await self.press("set_day", user, keyboard, f"set_day_{rng.randint(1, 28)}")
+            await self.press("set_month", user, after_day, f"set_month_{rng.randint(1, 12)}")
+            await self.command("nextbirthdays", chat_id, user, "/nextbirthdays")
+        except StepFailed:
+            pass
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def report(driver: LoadDriver, elapsed: float) -> None:
+    print(f"\nUpdates injected: {driver.updates_sent} in {elapsed:.1f} s "
+          f"({driver.updates_sent / elapsed:.0f} updates/s), timeouts: {driver.timeouts}, "
+          f"answers rejected by injected errors: {driver.rejected}")
+    print(f"{'step':<16} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    everything = []
+    for step, samples in driver.latencies.items():
+        samples.sort()
+        everything.extend(samples)
+        print(f"{step:<16} {len(samples):>7} {statistics.median(samples) * 1000:>9.1f} "
+              f"{_percentile(samples, 0.9) * 1000:>9.1f} {_percentile(samples, 0.99) * 1000:>9.1f} "
+              f"{samples[-1] * 1000:>9.1f}")
+    if everything:
+        everything.sort()
+        print(f"{'all':<16} {len(everything):>7} {statistics.median(everything) * 1000:>9.1f} "
+              f"{_percentile(everything, 0.9) * 1000:>9.1f} {_percentile(everything, 0.99) * 1000:>9.1f} "
+              f"{everything[-1] * 1000:>9.1f}")
+
+
+def spawn_bot(api: FakeBotAPI, database_url: str, log_path: str = os.devnull,
+              extra_env: Optional[dict] = None) -> subprocess.Popen:
+    """Run main.py against the fake API"""
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_BASE_URL": api.base_url,
+        "DATABASE_URL": database_url,
+    })
+    env.update(extra_env or {})
+    with open(log_path, "ab") as log:
+        return subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=ROOT, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+
+
+async def run(args) -> None:
+    faults = FaultConfig(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, args.rate_403)
+    api = FakeBotAPI(port=args.port, faults=faults)
+    await api.start()
+
+    bot = None
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.no_spawn:
+            # Simulated users hit the same chats far faster than real ones would
+            extra_env = {} if args.throttle else {"THROTTLE_ENABLED": "0"}
+            bot = spawn_bot(api, f"sqlite:///{os.path.join(tmp, 'loadtest.db')}", args.bot_log, extra_env)
+        try:
+            await asyncio.wait_for(api.polling_started.wait(), timeout=60)
+            driver = LoadDriver(api, args.step_timeout)
+            rng = random.Random(args.seed)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited(user_index: int) -> None:
+                async with semaphore:
+                    chat_id = -1000000000000 - user_index % args.chats
+                    await driver.user_flow(1000 + user_index, chat_id, rng.random() < args.join_share, rng)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(limited(i) for i in range(args.users)))
+            report(driver, time.perf_counter() - started)
+            print(f"API calls: {dict(sorted(api.call_counts.items()))}")
+        finally:
+            if bot is not None:
+                bot.terminate()
+                try:
+                    bot.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    bot.kill()
+            await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test main.py against a fake Bot API")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=100, help="Users running their flow at the same time")
+    parser.add_argument("--join-share", type=float, default=0.3, help="Share of users that join their chat first")
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--no-spawn", action="store_true", help="Drive a bot that is already running")
+    parser.add_argument("--bot-log", default=os.devnull, help="File for the spawned bot's output")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--throttle", action="store_true",
+                        help="Keep command throttling on (dropped commands count as timeouts)")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-403", type=float, default=0.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Per-greeting logging overhead on the event loop
+
+Sends --chats greetings through MessageDispatcher to a bot stub that
+answers at once (no rate limit, no network), under several logging
+setups, and reports the event-loop time per greeting above a run with
+logging disabled. "sync" is the previous setup (basicConfig-style handler
+writing in the caller, every record kept). For queued setups the time
+the listener thread needs to write out the backlog is shown separately:
+it is spent off the event loop.
+
+Every setup runs twice: writing to a local file, and with each write
+blocking for --write-latency-us, like stderr piped to a busy journald or
+log shipper. Log lines go to --output (default: a temporary file), never
+the terminal.
+
+Usage:
+    python -m benchmarks.logging_overhead --chats 20000 --repeat 3 --write-latency-us 50
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+
+class _SlowStream:
+    """File wrapper whose flush (once per record) blocks like a full pipe"""
+
+    def __init__(self, stream, latency: float):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text: str) -> int:
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _InstantBot:
+    token = "1:LOGGING"
+
+    async def send_message(self, chat_id: int, text: str) -> None:
+        return None
+
+
+SETUPS = [
+    # name, level, format, queued, sample_every
+    ("disabled", "WARNING", "text", False, 1),
+    ("sync, every record", "INFO", "text", False, 1),
+    ("queued, every record", "INFO", "text", True, 1),
+    ("queued, sampled", "INFO", "text", True, 100),
+    ("queued json, sampled", "INFO", "json", True, 100),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure logging overhead per greeting")
+    parser.add_argument("--chats", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--write-latency-us", type=float, default=50)
+    parser.add_argument("--output", help="File for the log lines (default: temporary file)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # dispatcher imports the database module; keep it away from a real database
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'logging.db')}")
+        from dispatcher import MessageDispatcher
+        from logging_setup import setup_logging, stop_logging
+
+        messages = [(-1000000000000 - index, "🎉 Сегодня день рождения у user! 🎂") for index in range(args.chats)]
+        output_path = args.output or os.path.join(tmp, "bot.log")
+
+        async def send_all() -> float:
+            dispatcher = MessageDispatcher(_InstantBot(), rate_per_second=1e9)
+            started = time.perf_counter()
+            await dispatcher.send_many(messages, "greeting")
+            return time.perf_counter() - started
+
+        results = {}
+        with open(output_path, "w") as output:
+            for latency_us in (0, args.write_latency_us):
+                stream = _SlowStream(output, latency_us / 1e6)
+                for name, level, fmt, queued, sample_every in SETUPS:
+                    loop_times, flush_times = [], []
+                    for _ in range(args.repeat):
+                        setup_logging(level, fmt, queued, sample_every, stream=stream)
+                        loop_times.append(asyncio.run(send_all()))
+                        started = time.perf_counter()
+                        stop_logging()
+                        flush_times.append(time.perf_counter() - started)
+                    results.setdefault(latency_us, []).append((name, min(loop_times), min(flush_times), queued))
+        logging.getLogger().handlers.clear()
+
+    print(f"{args.chats} greetings, best of {args.repeat}")
+    for latency_us, rows in results.items():
+        baseline = rows[0][1]
+        print(f"\nwrite latency {latency_us:.0f} us")
+        print(f"{'setup':<24} {'loop ms':>9} {'overhead us/greeting':>21} {'listener flush ms':>18}")
+        for name, loop_time, flush_time, queued in rows:
+            overhead = (loop_time - baseline) / args.chats * 1e6
+            flush = f"{flush_time * 1000:>18.1f}" if queued else f"{'-':>18}"
+            print(f"{name:<24} {loop_time * 1000:>9.1f} {overhead:>21.2f} {flush}")
+
+
+if __name__ == "__main__":
+    main()
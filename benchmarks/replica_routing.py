@@ -0,0 +1,100 @@
+"""
+Read/write routing check with a primary and a read replica
+
+With two SQLite files (default) the replica is a snapshot copy of the
+primary taken after loading the population, so it never catches up: this
+makes routing visible. With --primary/--replica pointing at a real
+Postgres primary and streaming replica the same checks run against live
+replication.
+
+Reports how many statements each engine served for the read-only service
+methods, then registers a user and checks that the user's and chat's reads
+see the write at once (pinned to the primary) and return to the replica
+after REPLICA_PIN_SECONDS.
+
+Usage:
+    python -m benchmarks.replica_routing --chats 200 --max-members 5000
+    python -m benchmarks.replica_routing --primary postgresql://.../bot --replica postgresql://replica/bot
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+
+def _sqlite_path(url: str) -> str:
+    return url.split("sqlite:///", 1)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check replica routing and read-your-writes")
+    parser.add_argument("--primary", help="Primary database URL (default: temporary SQLite file)")
+    parser.add_argument("--replica", help="Replica database URL (default: snapshot of the primary)")
+    parser.add_argument("--pin-seconds", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--max-members", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = args.primary or f"sqlite:///{os.path.join(tmp, 'primary.db')}"
+        replica = args.replica or f"sqlite:///{os.path.join(tmp, 'replica.db')}"
+        # database.py reads its configuration at import time
+        os.environ.update({
+            "DATABASE_URL": primary, "READ_DATABASE_URL": replica, "REPLICA_PIN_SECONDS": str(args.pin_seconds),
+        })
+        from sqlalchemy import event
+
+        from benchmarks import datagen
+        import database
+        from services import BirthdayService
+
+        if not args.primary:
+            registrations = datagen.populate(primary, datagen.population_from_args(args))
+            print(f"Loaded {registrations} registrations into the primary")
+            database.init_db()
+            database.mark_schema_current()
+            with sqlite3.connect(_sqlite_path(primary)) as source, sqlite3.connect(_sqlite_path(replica)) as target:
+                source.backup(target)
+            print("Replica is a snapshot of the primary")
+
+        statements = {"primary": 0, "replica": 0}
+        for name, target_engine in (("primary", database.engine), ("replica", database.read_engine)):
+            event.listen(target_engine, "before_cursor_execute",
+                         lambda *a, name=name: statements.__setitem__(name, statements[name] + 1))
+
+        with database.unit_of_work() as uow:
+            chat_id = uow.session.query(database.Membership.chat_id).first()[0]
+
+        for _ in range(args.repeat):
+            with database.unit_of_work() as uow:
+                BirthdayService.get_upcoming_birthdays(uow.session, chat_id)
+                BirthdayService.get_all_chat_birthdays(uow.session, chat_id)
+                BirthdayService.count_birthdays_in_chat(uow.session, chat_id)
+                BirthdayService.get_birthdays_today(uow.session)
+        print(f"Reads: {statements['primary']} statements on the primary, {statements['replica']} on the replica")
+
+        user_id = 10 ** 9
+        with database.unit_of_work() as uow:
+            BirthdayService.register_birthday(uow.session, user_id, chat_id, 15, 6, "replica_check")
+
+        def visible() -> bool:
+            with database.unit_of_work() as uow:
+                own = BirthdayService.get_user_birthday(uow.session, user_id, chat_id) is not None
+                listed = any(name == "replica_check"
+                             for name, _, _ in BirthdayService.get_all_chat_birthdays(uow.session, chat_id))
+            return own and listed
+
+        print(f"Right after registering: visible={visible()} (expected True, read from the primary)")
+        time.sleep(args.pin_seconds + 0.1)
+        after = visible()
+        expectation = "False with a snapshot replica" if not args.replica else "True once replicated"
+        print(f"After the pin expired:   visible={after} (expected {expectation})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Storage used by the legacy per-chat table vs. users + memberships
+
+Loads the same synthetic population (see benchmarks.datagen) into two
+SQLite files, one per schema, and compares their size after VACUUM and the
+time of the daily "birthdays today" lookup.
+
+Usage:
+    python -m benchmarks.schema_storage --chats 2000 --max-members 50000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import and_, text
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import datagen
+from database import Membership, User, UserBirthday, create_db_engine, no_index
+
+
+def _daily_lookup(url: str, schema: str, repeat: int = 20) -> float:
+    engine = create_db_engine(url, "balanced")
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    try:
+        start = time.perf_counter()
+        for i in range(repeat):
+            day, month = 1 + i % 28, 1 + i % 12
+            if schema == "normalized":
+                db.query(Membership.chat_id, User.username).join(User, User.user_id == Membership.user_id).filter(
+                    and_(User.day == day, User.month == month, no_index(Membership.bot_id) == 0)
+                ).all()
+            else:
+                db.query(UserBirthday.chat_id, UserBirthday.username).filter(
+                    and_(UserBirthday.day == day, UserBirthday.month == month)
+                ).all()
+        return (time.perf_counter() - start) / repeat * 1000
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare storage of the legacy and normalized schemas")
+    datagen.add_arguments(parser)
+    args = parser.parse_args()
+    population = datagen.population_from_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'schema':<12} {'registrations':>14} {'size MB':>9} {'bytes/reg':>10} {'daily ms':>9}")
+        for schema in ("legacy", "normalized"):
+            path = os.path.join(tmp, f"{schema}.db")
+            url = f"sqlite:///{path}"
+            registrations = datagen.populate(url, population, schema=schema)
+            engine = create_db_engine(url, "default")
+            with engine.connect() as conn:
+                conn.execute(text("VACUUM"))
+            engine.dispose()
+            size = os.path.getsize(path)
+            print(f"{schema:<12} {registrations:>14} {size / 2 ** 20:>9.1f} {size / registrations:>10.1f} "
+                  f"{_daily_lookup(url, schema):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Connection hold time: session-per-handler vs. per-update unit of work
+
+Simulates handlers that read a chat's birthdays and then reply over the
+network. The old pattern keeps its session open across the reply; the unit
+of work releases the connection before it. Pool checkout metrics
+(database.pool_stats) show the difference.
+
+Usage:
+    python -m benchmarks.session_hold --updates 200 --network-ms 50
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+
+from database import SessionLocal, init_db, pool_stats, unit_of_work  # noqa: E402
+from services import BirthdayService  # noqa: E402
+
+
+async def fake_reply(network_ms: int) -> None:
+    """Stand-in for an outbound Telegram request"""
+    await asyncio.sleep(network_ms / 1000)
+
+
+async def session_per_handler(chat_id: int, network_ms: int) -> None:
+    db = SessionLocal()
+    try:
+        BirthdayService.get_upcoming_birthdays(db, chat_id)
+        await fake_reply(network_ms)
+    finally:
+        db.close()
+
+
+async def per_update_unit_of_work(chat_id: int, network_ms: int) -> None:
+    with unit_of_work() as uow:
+        BirthdayService.get_upcoming_birthdays(uow.session, chat_id)
+    await fake_reply(network_ms)
+
+
+async def run(handler, updates: int, network_ms: int) -> dict:
+    pool_stats.reset()
+    for i in range(updates):
+        await handler(i % 10, network_ms)
+    return pool_stats.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure connection hold time per update")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--network-ms", type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    for name, handler in [("session-per-handler", session_per_handler),
+                          ("unit-of-work", per_update_unit_of_work)]:
+        stats = asyncio.run(run(handler, args.updates, args.network_ms))
+        print(f"{name:<20} checkouts={stats['checkouts']:<6} "
+              f"mean_hold={stats['mean_hold_seconds'] * 1000:.2f} ms "
+              f"max_hold={stats['max_hold_seconds'] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Startup time of main.py against the fake Bot API
+
+Measures, per run, the time from launching the process until it polls
+for updates ("ready") and until it answers a first /help ("first reply").
+The first run starts on an empty database; later runs restart on the
+same file, like a rolling restart. Exits with status 1 if the median
+ready time of the restarts exceeds --budget.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --budget 1.0
+    python -m benchmarks.startup --populate --chats 1000 --max-members 20000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks import datagen
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.loadtest import BOT_TOKEN, LoadDriver, StepFailed, spawn_bot
+from utils import bot_id_from_token
+
+
+async def measure(port: int, database_url: str, log_path: str) -> dict:
+    """Start the bot once and time it"""
+    api = FakeBotAPI(port=port)
+    await api.start()
+    started = time.perf_counter()
+    bot = spawn_bot(api, database_url, log_path)
+    try:
+        await asyncio.wait_for(api.polling_started.wait(), timeout=60)
+        ready = time.perf_counter() - started
+        user = {"id": 1, "is_bot": False, "first_name": "Startup", "username": "startup"}
+        try:
+            await LoadDriver(api, 30).command("help", -1000000000001, user, "/help")
+            first_reply = time.perf_counter() - started
+        except StepFailed:
+            first_reply = float("nan")
+        return {"ready": ready, "first_reply": first_reply}
+    finally:
+        bot.terminate()
+        bot.wait(timeout=30)
+        await api.stop()
+
+
+async def run(args) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        if args.populate:
+            registrations = datagen.populate(database_url, datagen.population_from_args(args),
+                                             bot_id=bot_id_from_token(BOT_TOKEN))
+            print(f"Loaded {registrations} registrations")
+
+        print(f"{'run':<10} {'ready ms':>9} {'first reply ms':>15}")
+        restarts = []
+        for index in range(args.runs):
+            result = await measure(args.port, database_url, args.bot_log)
+            label = "cold" if index == 0 and not args.populate else f"restart {index}"
+            print(f"{label:<10} {result['ready'] * 1000:>9.0f} {result['first_reply'] * 1000:>15.0f}")
+            if label != "cold":
+                restarts.append(result["ready"])
+
+    if not restarts:
+        return 0
+    median = statistics.median(restarts)
+    verdict = "OK" if median <= args.budget else "OVER BUDGET"
+    print(f"median restart ready: {median * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms) {verdict}")
+    return 0 if median <= args.budget else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure main.py startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0, help="Seconds allowed until polling starts")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--bot-log", default=os.devnull, help="File for the spawned bot's output")
+    parser.add_argument("--populate", action="store_true", help="Load a synthetic population first")
+    datagen.add_arguments(parser)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Table-driven birthday calendar
+
+Day-of-year tables are built once per year and "days until" grids once per
+day, so per-birthday work is two list lookups instead of building datetime
+objects. Birthdays on 29.02 are celebrated on 28.02 or 01.03 in non-leap
+years, depending on FEB29_POLICY.
+"""
+
+import calendar
+import os
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+FEB29_FEB28 = "feb28"
+FEB29_MAR1 = "mar1"
+
+
+def check_feb29_policy(feb29_policy: str) -> str:
+    """Return the policy if it is known, else raise ValueError"""
+    if feb29_policy not in (FEB29_FEB28, FEB29_MAR1):
+        raise ValueError(f"Unknown Feb 29 policy: {feb29_policy} (expected {FEB29_FEB28} or {FEB29_MAR1})")
+    return feb29_policy
+
+
+# Checked at import, so a bad value stops the bot at startup instead of failing requests
+FEB29_POLICY = check_feb29_policy(os.getenv("FEB29_POLICY", FEB29_FEB28))
+
+
+def today() -> date:
+    """Current local date (the one clock read shared by a calculation)"""
+    return datetime.now().date()
+
+
+class YearTable:
+    """Day-of-year lookup for one calendar year"""
+
+    def __init__(self, year: int, feb29_policy: str = FEB29_POLICY):
+        check_feb29_policy(feb29_policy)
+        self.year = year
+        self.is_leap = calendar.isleap(year)
+        self.length = 366 if self.is_leap else 365
+        # month_offsets[m] = number of days before the 1st of month m
+        self.month_offsets = [0] * 13
+        for month in range(2, 13):
+            self.month_offsets[month] = self.month_offsets[month - 1] + calendar.monthrange(year, month - 1)[1]
+        if self.is_leap:
+            self.feb29_day_of_year = 60
+        else:
+            self.feb29_day_of_year = 59 if feb29_policy == FEB29_FEB28 else 60
+
+    def day_of_year(self, day: int, month: int) -> int:
+        """1-based day of year on which a (day, month) birthday falls"""
+        if month == 2 and day == 29:
+            return self.feb29_day_of_year
+        return self.month_offsets[month] + day
+
+
+@lru_cache(maxsize=8)
+def year_table(year: int, feb29_policy: str = FEB29_POLICY) -> YearTable:
+    """Cached YearTable"""
+    return YearTable(year, feb29_policy)
+
+
+class DaysUntilTable:
+    """Days from a fixed date until the next occurrence of every (day, month)"""
+
+    def __init__(self, on: date, feb29_policy: str = FEB29_POLICY):
+        self.date = on
+        this_year = year_table(on.year, feb29_policy)
+        next_year = year_table(on.year + 1, feb29_policy)
+        today_doy = this_year.day_of_year(on.day, on.month)
+
+        # grid[month][day]; index 0 and impossible dates stay None
+        self.grid: List[List[Optional[int]]] = [[None] * 32 for _ in range(13)]
+        for month in range(1, 13):
+            row = self.grid[month]
+            for day in range(1, calendar.monthrange(2024, month)[1] + 1):
+                doy = this_year.day_of_year(day, month)
+                if doy >= today_doy:
+                    row[day] = doy - today_doy
+                else:
+                    row[day] = this_year.length - today_doy + next_year.day_of_year(day, month)
+
+    def days_until(self, day: int, month: int) -> int:
+        """Days until the next birthday (0 = today)"""
+        value = self.grid[month][day]
+        if value is None:
+            raise ValueError(f"Invalid date: {day:02d}.{month:02d}")
+        return value
+
+    def days_until_many(self, dates: Iterable[Tuple[int, int]]) -> List[int]:
+        """days_until for many (day, month) pairs at once"""
+        grid = self.grid
+        return [grid[month][day] for day, month in dates]
+
+    def is_today(self, day: int, month: int) -> bool:
+        return self.grid[month][day] == 0
+
+
+@lru_cache(maxsize=4)
+def days_until_table(on: date, feb29_policy: str = FEB29_POLICY) -> DaysUntilTable:
+    """Cached DaysUntilTable for a date"""
+    return DaysUntilTable(on, feb29_policy)
+
+
+def birthdays_celebrated_on(on: date, feb29_policy: str = FEB29_POLICY) -> List[Tuple[int, int]]:
+    """(day, month) pairs whose birthday is celebrated on a date"""
+    check_feb29_policy(feb29_policy)
+    dates = [(on.day, on.month)]
+    if not calendar.isleap(on.year):
+        celebrate_feb29 = (2, 28) if feb29_policy == FEB29_FEB28 else (3, 1)
+        if (on.month, on.day) == celebrate_feb29:
+            dates.append((29, 2))
+    return dates
@@ -0,0 +1,152 @@
+"""
+Chat lifecycle: notice when the bot can no longer reach a chat
+
+- my_chat_member updates mark chats inactive when the bot is removed and
+  active again when it is re-added.
+- Forbidden / "chat not found" errors from sending mark chats inactive;
+  ChatMigrated errors and migrate_to_chat_id service messages move the
+  chat's memberships to the new supergroup id.
+- DeadChatPurger deletes memberships of chats that stayed inactive past a
+  grace period, in small batches in the background.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Optional
+
+from telegram import ChatMember, Update
+from telegram.error import BadRequest, ChatMigrated, Forbidden, TelegramError
+from telegram.ext import ContextTypes
+
+import metrics
+from database import unit_of_work
+from services import ChatService
+
+logger = logging.getLogger(__name__)
+
+CHAT_PURGE_GRACE_DAYS = int(os.getenv("CHAT_PURGE_GRACE_DAYS", "7"))
+CHAT_PURGE_BATCH_SIZE = int(os.getenv("CHAT_PURGE_BATCH_SIZE", "500"))
+CHAT_PURGE_INTERVAL_SECONDS = 3600
+
+CHATS_DEACTIVATED = metrics.Counter(
+    "birthdaybot_chats_deactivated_total", "Chats marked inactive by reason", ["reason"]
+)
+CHATS_MIGRATED = metrics.Counter(
+    "birthdaybot_chats_migrated_total", "Groups whose memberships moved to a new supergroup id"
+)
+ROWS_PURGED = metrics.Counter(
+    "birthdaybot_dead_chat_rows_purged_total", "Memberships deleted from chats that stayed inactive"
+)
+
+_GONE_STATUSES = {ChatMember.LEFT, ChatMember.BANNED}
+
+
+def deactivate_chat(chat_id: int, reason: str) -> None:
+    """Mark a chat inactive"""
+    with unit_of_work() as uow:
+        ChatService.mark_inactive(uow.session, chat_id, reason)
+    CHATS_DEACTIVATED.labels(reason).inc()
+    logger.info("Chat %s marked inactive (%s)", chat_id, reason)
+
+
+def migrate_chat(old_chat_id: int, new_chat_id: int) -> None:
+    """Move a chat's memberships to its new supergroup id"""
+    with unit_of_work() as uow:
+        moved = ChatService.migrate_chat(uow.session, old_chat_id, new_chat_id)
+    CHATS_MIGRATED.inc()
+    logger.info("Chat %s migrated to %s (%s birthdays moved)", old_chat_id, new_chat_id, moved)
+
+
+def handle_send_error(chat_id: int, error: TelegramError) -> Optional[int]:
+    """
+    Update chat state after a failed send
+
+    Args:
+        chat_id: Chat the message was sent to
+        error: Error raised by the Bot API
+
+    Returns:
+        New chat id if the chat migrated (the caller may retry there), else None
+    """
+    if isinstance(error, ChatMigrated):
+        migrate_chat(chat_id, error.new_chat_id)
+        return error.new_chat_id
+    if isinstance(error, Forbidden):
+        deactivate_chat(chat_id, "forbidden")
+    elif isinstance(error, BadRequest) and "chat not found" in error.message.lower():
+        deactivate_chat(chat_id, "chat_not_found")
+    return None
+
+
+async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Track the bot being removed from or re-added to a chat"""
+    change = update.my_chat_member
+    chat_id = change.chat.id
+    status = change.new_chat_member.status
+
+    if status in _GONE_STATUSES:
+        deactivate_chat(chat_id, "kicked" if status == ChatMember.BANNED else "left")
+    else:
+        with unit_of_work() as uow:
+            reactivated = ChatService.reactivate(uow.session, chat_id)
+        if reactivated:
+            logger.info("Chat %s is active again", chat_id)
+
+
+async def chat_migrated(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the migrate_to_chat_id service message of a group upgraded to a supergroup"""
+    message = update.message
+    if message.migrate_to_chat_id:
+        migrate_chat(message.chat_id, message.migrate_to_chat_id)
+
+
+class DeadChatPurger:
+    """Background task deleting memberships of chats that stayed inactive"""
+
+    def __init__(self, grace_days: int = CHAT_PURGE_GRACE_DAYS, batch_size: int = CHAT_PURGE_BATCH_SIZE,
+                 interval_seconds: int = CHAT_PURGE_INTERVAL_SECONDS):
+        self.grace = timedelta(days=grace_days)
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.running = False
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        """Run purge passes until stopped"""
+        self.running = True
+        while self.running:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.error("Error purging dead chats: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def purge(self) -> int:
+        """Delete all purgeable memberships, one short transaction per batch"""
+        total = 0
+        while self.running:
+            # Each batch runs in a worker thread so update handling is not held up
+            deleted = await asyncio.to_thread(self._purge_batch)
+            if not deleted:
+                break
+            total += deleted
+            ROWS_PURGED.inc(deleted)
+            # Yield to update handling between batches
+            await asyncio.sleep(0.1)
+        if total:
+            logger.info("Purged %s birthdays of inactive chats", total)
+        return total
+
+    def _purge_batch(self) -> int:
+        with unit_of_work() as uow:
+            return ChatService.purge_inactive_batch(uow.session, self.grace, self.batch_size)
+
+    def stop(self) -> None:
+        """Stop after the current batch"""
+        self.running = False
+        self._wakeup.set()
@@ -1,19 +1,363 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime, UniqueConstraint
+from sqlalchemy import create_engine, event, select, BigInteger, Boolean, Column, Integer, String, Date, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, relationship, sessionmaker
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import UnaryExpression
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from typing import Optional
+import functools
+import inspect
 import os
+import threading
+import time
+
+import metrics
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///birthday_bot.db")
+STORAGE_PROFILE = os.getenv("STORAGE_PROFILE", "balanced")
+# Optional read replica for read-only service methods
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+# Users and chats written to within this window read from the primary (replication lag)
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "10"))
+
+# Bump whenever the models below change, so init_db() runs create_all again
+SCHEMA_VERSION = 5
+
+# Storage profiles: connect-time pragmas for SQLite, pool settings for Postgres
+STORAGE_PROFILES = {
+    # Library defaults (rollback journal, full sync, default pool)
+    "default": {
+        "sqlite_pragmas": {},
+        "postgres_pool": {},
+        "postgres_statement_timeout_ms": None,
+    },
+    # Safe for production: WAL keeps readers off the writer's lock
+    "balanced": {
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 64 * 1024 * 1024,
+            "cache_size": -16000,  # negative = KiB, i.e. ~16 MB
+            "busy_timeout": 5000,
+            "foreign_keys": "ON",
+        },
+        "postgres_pool": {
+            "pool_size": 10,
+            "max_overflow": 10,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+        },
+        "postgres_statement_timeout_ms": 5000,
+    },
+    # Bulk work (imports, benchmarks): bigger caches, temp tables in memory
+    "throughput": {
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64000,
+            "busy_timeout": 10000,
+            "temp_store": "MEMORY",
+            "foreign_keys": "ON",
+        },
+        "postgres_pool": {
+            "pool_size": 20,
+            "max_overflow": 20,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+        },
+        "postgres_statement_timeout_ms": 30000,
+    },
+}
+
+
+def _apply_sqlite_pragmas(engine, pragmas: dict) -> None:
+    """Run PRAGMA statements on every new SQLite connection"""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def create_db_engine(url: str = DATABASE_URL, profile: str = STORAGE_PROFILE, **kwargs):
+    """
+    Create an engine tuned according to a storage profile
+    
+    Args:
+        url: Database URL
+        profile: Name of a profile from STORAGE_PROFILES
+        **kwargs: Extra arguments passed to create_engine
+    
+    Returns:
+        SQLAlchemy engine
+    """
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile} (expected one of {', '.join(STORAGE_PROFILES)})")
+    settings = STORAGE_PROFILES[profile]
+    backend = make_url(url).get_backend_name()
+
+    if backend == "postgresql":
+        options = dict(settings["postgres_pool"])
+        timeout = settings["postgres_statement_timeout_ms"]
+        if timeout:
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+        options.update(kwargs)
+        return create_engine(url, echo=False, **options)
+
+    db_engine = create_engine(url, echo=False, **kwargs)
+    if backend == "sqlite":
+        _apply_sqlite_pragmas(db_engine, settings["sqlite_pragmas"])
+    return db_engine
+
+
+class PoolStats:
+    """Connection pool checkout counters, used to see how long connections are held"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_hold_seconds = 0.0
+        self.max_hold_seconds = 0.0
+
+    def attach(self, db_engine) -> None:
+        """Listen to checkout/checkin events of an engine's pool"""
+        event.listen(db_engine, "checkout", self._on_checkout)
+        event.listen(db_engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_started"] = time.perf_counter()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        started = connection_record.info.pop("checkout_started", None)
+        if started is None:
+            return
+        held = time.perf_counter() - started
+        with self._lock:
+            self.checkouts += 1
+            self.total_hold_seconds += held
+            if held > self.max_hold_seconds:
+                self.max_hold_seconds = held
+
+    def snapshot(self) -> dict:
+        """Return current counters"""
+        with self._lock:
+            mean = self.total_hold_seconds / self.checkouts if self.checkouts else 0.0
+            return {
+                "checkouts": self.checkouts,
+                "total_hold_seconds": self.total_hold_seconds,
+                "mean_hold_seconds": mean,
+                "max_hold_seconds": self.max_hold_seconds,
+            }
+
+    def reset(self) -> None:
+        """Reset all counters"""
+        with self._lock:
+            self.checkouts = 0
+            self.total_hold_seconds = 0.0
+            self.max_hold_seconds = 0.0
+
+
+class ReplicaPins:
+    """Users and chats recently written to, whose reads must see the primary"""
+
+    def __init__(self, ttl_seconds: float = REPLICA_PIN_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._expires: "OrderedDict[tuple, float]" = OrderedDict()
+
+    def pin(self, chat_id: Optional[int] = None, user_id: Optional[int] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in (("chat", chat_id), ("user", user_id)):
+                if key[1] is not None:
+                    self._expires.pop(key, None)
+                    self._expires[key] = now + self.ttl_seconds
+            # Entries are in expiry order: drop the expired head
+            while self._expires and next(iter(self._expires.values())) <= now:
+                self._expires.popitem(last=False)
+
+    def is_pinned(self, chat_id: Optional[int] = None, user_id: Optional[int] = None) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                self._expires.get(key, 0.0) > now
+                for key in (("chat", chat_id), ("user", user_id)) if key[1] is not None
+            )
+
+
+# Bot whose data the current update or job works on (set per update by main.py, per bot by the scheduler)
+current_bot_id: ContextVar[int] = ContextVar("current_bot_id", default=0)
+
+
+@contextmanager
+def bot_scope(bot_id: int):
+    """Run a block on behalf of one bot"""
+    token = current_bot_id.set(bot_id)
+    try:
+        yield
+    finally:
+        current_bot_id.reset(token)
 
-engine = create_engine(DATABASE_URL, echo=False)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def no_index(column):
+    """
+    The column behind a unary plus, so the planner does not drive a query from it
+
+    Used for Membership.bot_id in the daily date queries: without
+    statistics SQLite takes "bot_id = ?" for selective and reads every
+    membership of the bot instead of searching the users (month, day) index.
+    """
+    return UnaryExpression(column, operator=operators.custom_op("+"), type_=column.type)
+
+
+# Set by read_only() for the duration of a call: True routes this session's reads to the replica
+_use_replica: ContextVar[bool] = ContextVar("use_replica", default=False)
+
+
+class RoutingSession(Session):
+    """Session sending reads of read_only() calls to the replica and everything else to the primary"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            read_engine is not engine
+            and _use_replica.get()
+            and not self._flushing
+            and not self.info.get("wrote")
+            and not isinstance(clause, UpdateBase)
+        ):
+            return read_engine
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+def read_only(fn):
+    """
+    Route a service method's queries to the read replica
+
+    Calls for a chat_id / user_id argument written to in the last
+    REPLICA_PIN_SECONDS stay on the primary, so a user sees their own
+    registration immediately.
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if read_engine is engine:
+            return fn(*args, **kwargs)
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+        pinned = replica_pins.is_pinned(arguments.get("chat_id"), arguments.get("user_id"))
+        ROUTED_READS.labels("primary" if pinned else "replica").inc()
+        token = _use_replica.set(not pinned)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
+
+
+ROUTED_READS = metrics.Counter(
+    "birthdaybot_db_routed_reads_total", "Read-only service calls by target engine", ["target"]
+)
+# Created up front: read_only methods also run in worker threads
+for _target in ("primary", "replica"):
+    ROUTED_READS.labels(_target)
+
+engine = create_db_engine(DATABASE_URL, STORAGE_PROFILE)
+pool_stats = PoolStats()
+pool_stats.attach(engine)
+metrics.instrument_engine(engine, pool_stats)
+if READ_DATABASE_URL:
+    read_engine = create_db_engine(READ_DATABASE_URL, STORAGE_PROFILE)
+    metrics.instrument_engine(read_engine, pool_gauges=False)
+else:
+    read_engine = engine
+replica_pins = ReplicaPins()
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+@event.listens_for(RoutingSession, "after_flush")
+def _pin_flushed_rows(session, flush_context):
+    """Pin the users and chats of written rows to the primary"""
+    session.info["wrote"] = True
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        replica_pins.pin(getattr(obj, "chat_id", None), getattr(obj, "user_id", None))
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _note_bulk_write(orm_execute_state):
+    # query.update() / delete() bypass the flush; later reads in the transaction must see them
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+@event.listens_for(RoutingSession, "after_rollback")
+def _end_write_transaction(session):
+    session.info.pop("wrote", None)
+
+
+class User(Base):
+    """A Telegram user's birthday, shared by every chat the user opted in to"""
+    __tablename__ = "users"
+
+    user_id = Column(BigInteger, primary_key=True)
+    username = Column(String, nullable=True)  # Store username for greeting message
+    day = Column(Integer, nullable=False)  # Day of month (1-31)
+    month = Column(Integer, nullable=False)  # Month (1-12)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Serves the daily birthday lookup
+    __table_args__ = (Index("ix_users_month_day", "month", "day"),)
+
+    def __repr__(self):
+        return f"<User(user_id={self.user_id}, date={self.day}.{self.month:02d})>"
+
+
+class Membership(Base):
+    """A user's participation in a chat's birthday greetings"""
+    __tablename__ = "memberships"
+
+    bot_id = Column(BigInteger, primary_key=True, default=0)  # Bot the chat is served by
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    opt_in = Column(Boolean, nullable=False, default=True)  # False after /deletebirthday
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Lets the session insert users before their memberships
+    user = relationship(User)
+
+    __table_args__ = (
+        Index("ix_memberships_bot_chat", "bot_id", "chat_id"),
+        # Lookups by user (cache invalidation, username flush) and joins driven from the users date index
+        Index("ix_memberships_user_bot", "user_id", "bot_id"),
+    )
+
+    def __repr__(self):
+        return f"<Membership(bot_id={self.bot_id}, user_id={self.user_id}, chat_id={self.chat_id}, opt_in={self.opt_in})>"
+
+
 class UserBirthday(Base):
-    """Model to store user birthday information scoped per chat"""
+    """
+    Legacy per-chat birthday rows
+
+    Superseded by User + Membership; migrations.py moves remaining rows over.
+    """
     __tablename__ = "user_birthdays"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -32,9 +376,152 @@ class UserBirthday(Base):
         return f"<UserBirthday(user_id={self.user_id}, chat_id={self.chat_id}, date={self.day}.{self.month:02d})>"
 
 
-def init_db():
-    """Initialize database tables"""
+class ChatState(Base):
+    """Lifecycle state of a chat; chats without a row are active"""
+    __tablename__ = "chat_states"
+
+    bot_id = Column(BigInteger, primary_key=True, default=0)
+    chat_id = Column(BigInteger, primary_key=True)
+    status = Column(String, nullable=False, index=True)  # "inactive" or "migrated"
+    reason = Column(String, nullable=True)  # e.g. "kicked", "forbidden", "chat_not_found"
+    migrated_to = Column(BigInteger, nullable=True)  # New supergroup id for migrated chats
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ChatState(bot_id={self.bot_id}, chat_id={self.chat_id}, status={self.status})>"
+
+
+class ChatSettings(Base):
+    """Per-chat preferences; chats without a row use the defaults"""
+    __tablename__ = "chat_settings"
+
+    bot_id = Column(BigInteger, primary_key=True, default=0)
+    chat_id = Column(BigInteger, primary_key=True)
+    digest_days = Column(Integer, nullable=True)  # Advance digest lead time in days, 0 = off, NULL = default
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ChatSettings(bot_id={self.bot_id}, chat_id={self.chat_id}, digest_days={self.digest_days})>"
+
+
+class Meta(Base):
+    """Key/value store for bookkeeping such as the schema version"""
+    __tablename__ = "meta"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Meta(key={self.key}, value={self.value})>"
+
+
+def get_meta(key: str) -> Optional[str]:
+    """Read a meta value (None if unset or the table does not exist yet)"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(Meta.value).where(Meta.key == key)).scalar()
+    except DBAPIError:
+        return None
+
+
+def set_meta(key: str, value: str) -> None:
+    """Insert or update a meta value"""
+    with unit_of_work() as uow:
+        row = uow.session.get(Meta, key)
+        if row is None:
+            uow.session.add(Meta(key=key, value=value))
+        else:
+            row.value = value
+
+
+def init_db() -> bool:
+    """
+    Initialize database tables unless the stored schema version is current
+
+    Checking the version is a single primary-key read, which keeps restarts
+    fast; create_all inspects every table.
+
+    Returns:
+        True if create_all ran (call mark_schema_current() once any data
+        migration has finished)
+    """
+    if get_meta("schema_version") == str(SCHEMA_VERSION):
+        return False
     Base.metadata.create_all(bind=engine)
+    return True
+
+
+def mark_schema_current() -> None:
+    """Record that the database matches SCHEMA_VERSION"""
+    set_meta("schema_version", str(SCHEMA_VERSION))
+
+
+class UnitOfWork:
+    """
+    Database work of a single update
+
+    The session is opened on first use, so updates that never touch the
+    database never check out a connection. Commit releases the connection
+    back to the pool.
+    """
+
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory or SessionLocal
+        self._session = None
+
+    @property
+    def session(self):
+        """Session of this unit of work (opened lazily)"""
+        if self._session is None:
+            self._session = self._session_factory()
+        return self._session
+
+    def commit(self) -> None:
+        """Commit pending changes, if a session was opened"""
+        if self._session is not None:
+            self._session.commit()
+
+    def rollback(self) -> None:
+        """Roll back pending changes, if a session was opened"""
+        if self._session is not None:
+            self._session.rollback()
+
+    def close(self) -> None:
+        """Close the session and return its connection to the pool"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar("current_unit_of_work", default=None)
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Open (or join) the unit of work of the current update
+
+    Commits once when the outermost block exits and rolls back on error.
+    Keep outbound Telegram requests outside of the block so that no
+    connection is held during network I/O.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        yield current
+        return
+
+    uow = UnitOfWork()
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+        uow.commit()
+    except Exception:
+        uow.rollback()
+        raise
+    finally:
+        uow.close()
+        _current_unit_of_work.reset(token)
 
 
 def get_db():
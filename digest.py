@@ -0,0 +1,198 @@
+"""
+Advance-reminder digests ("birthdays in the next days")
+
+Each morning, after the day-of greetings, every chat with a lead time gets
+one message listing the birthdays of the next N days (today excluded; the
+greeting covers it). All chats are computed in one pass: a single query
+searches the users (month, day) index over the dates of the longest lead
+time, joins their memberships by user and streams the rows sorted by chat
+(only the matching rows are sorted), and each chat's group is cut down to
+its own lead time. Digests are rendered in a worker thread and handed
+to the bot's MessageDispatcher in chunks of DIGEST_SEND_CHUNK through a
+small bounded queue, so memory stays flat however many chats there are.
+
+Lead time per chat is set with /digest <days>; chats without a setting use
+DIGEST_DEFAULT_DAYS (0 = no digest).
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from itertools import groupby
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+import metrics
+from birthday_calendar import birthdays_celebrated_on, today
+from database import (
+    ChatSettings, ChatState, Membership, User, bot_scope, current_bot_id, no_index, read_only, unit_of_work,
+)
+from dispatcher import MessageDispatcher
+from utils import format_date
+
+logger = logging.getLogger(__name__)
+
+DIGEST_DEFAULT_DAYS = int(os.getenv("DIGEST_DEFAULT_DAYS", "0"))
+DIGEST_MAX_DAYS = 14
+DIGEST_STREAM_BATCH = 1000
+# Digests per send_many call, and how many rendered chunks may wait for the sender
+DIGEST_SEND_CHUNK = 500
+DIGEST_QUEUED_CHUNKS = 2
+
+DIGESTS = metrics.Counter(
+    "birthdaybot_digests_total", "Advance digests by result", ["result"]
+)
+DIGEST_RUN_DURATION = metrics.Histogram(
+    "birthdaybot_digest_run_duration_seconds", "Duration of a digest run (query and sending)",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+
+
+def window_dates(on: date, days: int) -> Dict[Tuple[int, int], int]:
+    """(day, month) -> days until it is celebrated, for the next `days` days"""
+    window = {}
+    for offset in range(1, days + 1):
+        for day_month in birthdays_celebrated_on(on + timedelta(days=offset)):
+            window.setdefault(day_month, offset)
+    return window
+
+
+def month_ranges(window: Dict[Tuple[int, int], int]) -> List[Tuple[int, int, int]]:
+    """Collapse window dates into (month, first_day, last_day) index ranges"""
+    ranges: Dict[int, Tuple[int, int]] = {}
+    for day, month in window:
+        first, last = ranges.get(month, (day, day))
+        ranges[month] = (min(first, day), max(last, day))
+    return [(month, first, last) for month, (first, last) in ranges.items()]
+
+
+def iter_chat_digests(db: Session, on: date, default_days: int = DIGEST_DEFAULT_DAYS,
+                      max_days: int = DIGEST_MAX_DAYS) -> Iterator[Tuple[int, List[Tuple[str, int, int, int]]]]:
+    """
+    Stream (chat_id, [(username, day, month, days_until)]) for every chat with upcoming birthdays
+
+    Rows are read in chat order in batches, so memory does not grow with
+    the number of chats.
+    """
+    bot_id = current_bot_id.get()
+    longest = db.query(func.max(ChatSettings.digest_days)).filter(ChatSettings.bot_id == bot_id).scalar() or 0
+    horizon = min(max_days, max(longest, default_days))
+    if horizon <= 0:
+        return
+
+    window = window_dates(on, horizon)
+    lead_days = func.coalesce(ChatSettings.digest_days, default_days)
+    dead_chats = select(ChatState.chat_id).where(ChatState.bot_id == bot_id)
+    rows = db.query(
+        Membership.chat_id, lead_days.label("lead_days"), User.user_id, User.username, User.day, User.month
+    ).join(
+        User, User.user_id == Membership.user_id
+    ).outerjoin(
+        ChatSettings, and_(ChatSettings.bot_id == Membership.bot_id, ChatSettings.chat_id == Membership.chat_id)
+    ).filter(
+        no_index(Membership.bot_id) == bot_id,
+        or_(*(and_(User.month == month, User.day.between(first, last)) for month, first, last in month_ranges(window))),
+        Membership.opt_in.is_(True),
+        Membership.chat_id.not_in(dead_chats),
+        lead_days > 0,
+    ).order_by(Membership.chat_id).yield_per(DIGEST_STREAM_BATCH)
+
+    for chat_id, chat_rows in groupby(rows, key=lambda row: row.chat_id):
+        entries = []
+        for row in chat_rows:
+            days_until = window.get((row.day, row.month))
+            if days_until is not None and days_until <= min(row.lead_days, max_days):
+                entries.append((row.username or f"User {row.user_id}", row.day, row.month, days_until))
+        if entries:
+            yield chat_id, sorted(entries, key=lambda entry: (entry[3], entry[0]))
+
+
+def render_digest(entries: List[Tuple[str, int, int, int]]) -> str:
+    """Digest message for one chat"""
+    message = "🗓 Скоро дни рождения:\n\n"
+    for username, day, month, days_until in entries:
+        when = "завтра" if days_until == 1 else f"через {days_until} дн."
+        message += f"📅 {username} - {format_date(day, month)} ({when})\n"
+    return message
+
+
+@read_only
+def stream_digests(on: date, emit: Callable[[List[Tuple[int, str]]], bool],
+                   chunk_size: int = DIGEST_SEND_CHUNK) -> None:
+    """
+    Render every chat's digest in one unit of work, passing them to emit in chunks (run in a worker thread)
+
+    The query stays open while chunks are sent. Stops early when emit
+    returns False.
+    """
+    with unit_of_work() as uow:
+        chunk = []
+        for chat_id, entries in iter_chat_digests(uow.session, on):
+            chunk.append((chat_id, render_digest(entries)))
+            if len(chunk) >= chunk_size:
+                if not emit(chunk):
+                    return
+                chunk = []
+        if chunk:
+            emit(chunk)
+
+
+class DigestJob:
+    """Computes and sends the morning digests"""
+
+    async def run(self, dispatcher: MessageDispatcher) -> int:
+        """
+        Send today's digests of the dispatcher's bot
+
+        Returns:
+            Number of digests delivered
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        # None marks the end of the stream
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=DIGEST_QUEUED_CHUNKS)
+        cancelled = threading.Event()
+
+        def put(chunk: Optional[List[Tuple[int, str]]]) -> bool:
+            # Blocks the worker thread while the queue is full, until the sender catches up or gives up
+            future = asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return not cancelled.is_set()
+                except concurrent.futures.TimeoutError:
+                    if cancelled.is_set():
+                        future.cancel()
+                        return False
+
+        def produce() -> None:
+            try:
+                stream_digests(today(), put)
+            finally:
+                put(None)
+
+        total_sent = total_failed = 0
+        with bot_scope(dispatcher.bot_id):
+            producer = asyncio.ensure_future(asyncio.to_thread(produce))
+        try:
+            while (chunk := await chunks.get()) is not None:
+                sent, failed = await dispatcher.send_many(chunk, "digest")
+                DIGESTS.labels("sent").inc(sent)
+                DIGESTS.labels("failed").inc(failed)
+                total_sent += sent
+                total_failed += failed
+        finally:
+            cancelled.set()
+            try:
+                await producer
+            finally:
+                DIGEST_RUN_DURATION.observe(time.perf_counter() - started)
+        if total_sent or total_failed:
+            logger.info("Birthday digests sent to %s chats (%s failed)", total_sent, total_failed)
+        return total_sent
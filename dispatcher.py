@@ -0,0 +1,114 @@
+"""
+Rate-limited sending of scheduled messages
+
+Day-of greetings and advance digests go out through one MessageDispatcher
+so that together they stay under the Bot API's broadcast limit (about 30
+messages per second). Limits apply per bot token, so each bot hosted in
+the process has its own dispatcher. Sends are spaced evenly; a 429
+RetryAfter pauses every sender of that bot for the requested time before
+retrying. Kicked, deleted and migrated chats are handled as in
+chat_lifecycle.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Iterable, Tuple
+
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+
+import metrics
+from chat_lifecycle import handle_send_error
+from database import bot_scope
+from logging_setup import SAMPLED
+from utils import bot_id_from_token
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_RATE_PER_SECOND = float(os.getenv("DISPATCH_RATE_PER_SECOND", "25"))
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "8"))
+DISPATCH_MAX_RETRIES = 3
+
+DISPATCHED = metrics.Counter(
+    "birthdaybot_dispatched_messages_total", "Scheduled messages by kind and result", ["kind", "result"]
+)
+DISPATCH_RETRY_AFTER = metrics.Counter(
+    "birthdaybot_dispatch_retry_after_total", "RetryAfter (429) responses to scheduled messages"
+)
+
+
+class MessageDispatcher:
+    """Sends one bot's scheduled messages at a bounded rate"""
+
+    def __init__(self, bot: Bot, rate_per_second: float = DISPATCH_RATE_PER_SECOND,
+                 concurrency: int = DISPATCH_CONCURRENCY, max_retries: int = DISPATCH_MAX_RETRIES):
+        self.bot = bot
+        self.bot_id = bot_id_from_token(bot.token)
+        self.interval = 1.0 / rate_per_second
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _wait_for_slot(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _pause(self, seconds: float) -> None:
+        """Hold back every sender for a RetryAfter period"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+    async def send(self, chat_id: int, text: str, kind: str = "greeting", retry_migrated: bool = True) -> bool:
+        """
+        Send one message, waiting for a free slot
+
+        Returns:
+            True if the message was delivered (possibly to the chat's new supergroup id)
+        """
+        for _ in range(self.max_retries + 1):
+            await self._wait_for_slot()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                DISPATCHED.labels(kind, "sent").inc()
+                logger.info("Sent %s to chat %s", kind, chat_id, extra=SAMPLED)
+                return True
+            except RetryAfter as e:
+                DISPATCH_RETRY_AFTER.inc()
+                logger.warning("Flood limit hit sending to chat %s, pausing %s s", chat_id, e.retry_after)
+                self._pause(float(e.retry_after))
+            except TelegramError as e:
+                logger.error("Error sending message to chat %s: %s", chat_id, e)
+                # Kicked / deleted chats stop being messaged; migrated groups are retried once
+                with bot_scope(self.bot_id):
+                    new_chat_id = handle_send_error(chat_id, e)
+                if new_chat_id and retry_migrated:
+                    return await self.send(new_chat_id, text, kind, retry_migrated=False)
+                break
+            except Exception as e:
+                logger.error("Unexpected error sending message to chat %s: %s", chat_id, e)
+                break
+        DISPATCHED.labels(kind, "failed").inc()
+        return False
+
+    async def send_many(self, messages: Iterable[Tuple[int, str]], kind: str) -> Tuple[int, int]:
+        """
+        Send (chat_id, text) pairs with a few requests in flight at a time
+
+        Returns:
+            Tuple of (sent, failed)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(chat_id: int, text: str) -> bool:
+            async with semaphore:
+                return await self.send(chat_id, text, kind)
+
+        results = await asyncio.gather(*(send_one(chat_id, text) for chat_id, text in messages))
+        sent = sum(results)
+        return sent, len(results) - sent
@@ -1,10 +1,13 @@
 import logging
+import metrics
+import profiling
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from database import SessionLocal
-from services import BirthdayService
-from utils import validate_date, parse_date_string, format_date, delete_message_after_delay
-import asyncio
+from database import unit_of_work
+from response_cache import RESPONSE_CACHE
+from services import BirthdayService, ChatService
+from digest import DIGEST_DEFAULT_DAYS, DIGEST_MAX_DAYS
+from utils import validate_date, parse_date_string, format_date, schedule_message_deletion
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +30,53 @@ MONTH_NAMES_FULL = {
 }
 
 
+def render_next_birthdays(chat_id: int) -> str:
+    """Build the /nextbirthdays reply for a chat"""
+    with unit_of_work() as uow:
+        upcoming = BirthdayService.get_upcoming_birthdays(uow.session, chat_id, days_ahead=7)
+
+    if not upcoming:
+        return "📭 Нет предстоящих дней рождения на неделю."
+
+    message = "🎂 Ближайшие дни рождения (на неделю):\n\n"
+    for username, day, month, days_until in upcoming:
+        date_str = format_date(day, month)
+        if days_until == 0:
+            message += f"🎉 {username} - сегодня! ({date_str})\n"
+        else:
+            message += f"📅 {username} - {date_str} (через {days_until} дн.)\n"
+    return message
+
+
+def render_chat_birthdays(chat_id: int) -> str:
+    """Build the /listbirthdays reply for a chat"""
+    with unit_of_work() as uow:
+        birthdays = BirthdayService.get_all_chat_birthdays(uow.session, chat_id)
+
+    if not birthdays:
+        return "📭 В этом чате еще никто не зарегистрировал свой день рождения."
+
+    message = "📋 Дни рождения в этом чате:\n\n"
+    for username, day, month in sorted(birthdays, key=lambda x: (x[2], x[1])):
+        date_str = format_date(day, month)
+        message += f"• {username} - {date_str}\n"
+    return message
+
+
+async def is_chat_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Check that the sender administers the chat, replying if not"""
+    try:
+        chat_member = await context.bot.get_chat_member(update.message.chat_id, update.message.from_user.id)
+        if chat_member.status not in ['administrator', 'creator']:
+            await update.message.reply_text("❌ Эта команда доступна только администраторам чата.")
+            return False
+    except Exception as e:
+        logger.error("Error checking admin status: %s", e)
+        await update.message.reply_text("❌ Ошибка при проверке прав доступа.")
+        return False
+    return True
+
+
 class BirthdayHandler:
     """Handler for birthday-related commands"""
 
@@ -50,12 +100,13 @@ class BirthdayHandler:
             "/deletebirthday - Удалить день рождения\n"
             "/nextbirthdays - Ближайшие дни рождения (на неделю)\n"
             "/listbirthdays - Все дни рождения в чате (только для администраторов)\n"
+            "/digest [дни] - Напоминание о днях рождения заранее (только для администраторов)\n"
             "/help - Эта справка\n\n"
             "💡 Выбирайте дату нажатием кнопок!"
         )
         await update.message.reply_text(help_text)
         # Delete command message after 30 seconds
-        asyncio.create_task(delete_message_after_delay(update, delay_seconds=30))
+        schedule_message_deletion(update, delay_seconds=30)
 
     @staticmethod
     async def set_birthday_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -126,14 +177,11 @@ class BirthdayHandler:
             return WAITING_FOR_MONTH
 
         # Save to database
-        db = SessionLocal()
-        try:
+        with unit_of_work() as uow:
             success, message = BirthdayService.register_birthday(
-                db, user_id, chat_id, day, month, username
+                uow.session, user_id, chat_id, day, month, username
             )
-            await query.edit_message_text(text=message)
-        finally:
-            db.close()
+        await query.edit_message_text(text=message)
 
         return ConversationHandler.END
 
@@ -143,21 +191,19 @@ class BirthdayHandler:
         user_id = update.message.from_user.id
         chat_id = update.message.chat_id
 
-        db = SessionLocal()
-        try:
-            birthday = BirthdayService.get_user_birthday(db, user_id, chat_id)
-            if birthday:
-                date_str = format_date(birthday.day, birthday.month)
-                await update.message.reply_text(f"🎂 Ваш день рождения: {date_str}")
-            else:
-                await update.message.reply_text(
-                    "❌ Вы еще не зарегистрировали свой день рождения в этом чате.\n"
-                    "Используйте /setbirthday для регистрации."
-                )
-        finally:
-            db.close()
+        with unit_of_work() as uow:
+            birthday = BirthdayService.get_user_birthday(uow.session, user_id, chat_id)
+            date_str = format_date(birthday.day, birthday.month) if birthday else None
+
+        if date_str:
+            await update.message.reply_text(f"🎂 Ваш день рождения: {date_str}")
+        else:
+            await update.message.reply_text(
+                "❌ Вы еще не зарегистрировали свой день рождения в этом чате.\n"
+                "Используйте /setbirthday для регистрации."
+            )
         # Delete command message after 30 seconds
-        asyncio.create_task(delete_message_after_delay(update, delay_seconds=30))
+        schedule_message_deletion(update, delay_seconds=30)
 
     @staticmethod
     async def update_birthday_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -228,14 +274,11 @@ class BirthdayHandler:
             return WAITING_FOR_MONTH
 
         # Update in database
-        db = SessionLocal()
-        try:
+        with unit_of_work() as uow:
             success, message = BirthdayService.register_birthday(
-                db, user_id, chat_id, day, month, username
+                uow.session, user_id, chat_id, day, month, username
             )
-            await query.edit_message_text(text=message)
-        finally:
-            db.close()
+        await query.edit_message_text(text=message)
 
         return ConversationHandler.END
 
@@ -245,77 +288,69 @@ class BirthdayHandler:
         user_id = update.message.from_user.id
         chat_id = update.message.chat_id
 
-        db = SessionLocal()
-        try:
-            success, message = BirthdayService.delete_birthday(db, user_id, chat_id)
-            await update.message.reply_text(message)
-        finally:
-            db.close()
+        with unit_of_work() as uow:
+            success, message = BirthdayService.delete_birthday(uow.session, user_id, chat_id)
+        await update.message.reply_text(message)
         # Delete command message after 30 seconds
-        asyncio.create_task(delete_message_after_delay(update, delay_seconds=30))
+        schedule_message_deletion(update, delay_seconds=30)
 
     @staticmethod
     async def next_birthdays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Show upcoming birthdays in chat (next 7 days)"""
         chat_id = update.message.chat_id
 
-        db = SessionLocal()
-        try:
-            upcoming = BirthdayService.get_upcoming_birthdays(db, chat_id, days_ahead=7)
-            
-            if not upcoming:
-                await update.message.reply_text("📭 Нет предстоящих дней рождения на неделю.")
-                return
-
-            message = "🎂 Ближайшие дни рождения (на неделю):\n\n"
-            for username, day, month, days_until in upcoming:
-                date_str = format_date(day, month)
-                if days_until == 0:
-                    message += f"🎉 {username} - сегодня! ({date_str})\n"
-                else:
-                    message += f"📅 {username} - {date_str} (через {days_until} дн.)\n"
-
-            await update.message.reply_text(message)
-        finally:
-            db.close()
+        message = await RESPONSE_CACHE.get_or_render(
+            chat_id, "nextbirthdays", lambda: render_next_birthdays(chat_id)
+        )
+        await update.message.reply_text(message)
         # Delete command message after 30 seconds
-        asyncio.create_task(delete_message_after_delay(update, delay_seconds=30))
+        schedule_message_deletion(update, delay_seconds=30)
 
     @staticmethod
     async def list_birthdays(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """List all birthdays in chat (admin only)"""
         chat_id = update.message.chat_id
-        user_id = update.message.from_user.id
 
-        # Check if user is admin
-        try:
-            chat_member = await context.bot.get_chat_member(chat_id, user_id)
-            if chat_member.status not in ['administrator', 'creator']:
-                await update.message.reply_text("❌ Эта команда доступна только администраторам чата.")
-                return
-        except Exception as e:
-            logger.error(f"Error checking admin status: {e}")
-            await update.message.reply_text("❌ Ошибка при проверке прав доступа.")
+        if not await is_chat_admin(update, context):
             return
 
-        db = SessionLocal()
-        try:
-            birthdays = BirthdayService.get_all_chat_birthdays(db, chat_id)
-            
-            if not birthdays:
-                await update.message.reply_text("📭 В этом чате еще никто не зарегистрировал свой день рождения.")
-                return
+        message = await RESPONSE_CACHE.get_or_render(
+            chat_id, "listbirthdays", lambda: render_chat_birthdays(chat_id)
+        )
+        await update.message.reply_text(message)
+        # Delete command message after 30 seconds
+        schedule_message_deletion(update, delay_seconds=30)
+
+    @staticmethod
+    async def digest_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Show or set the chat's advance digest lead time (admin only)"""
+        chat_id = update.message.chat_id
 
-            message = "📋 Дни рождения в этом чате:\n\n"
-            for username, day, month in sorted(birthdays, key=lambda x: (x[2], x[1])):
-                date_str = format_date(day, month)
-                message += f"• {username} - {date_str}\n"
+        if not await is_chat_admin(update, context):
+            return
 
-            await update.message.reply_text(message)
-        finally:
-            db.close()
-        # Delete command message after 30 seconds
-        asyncio.create_task(delete_message_after_delay(update, delay_seconds=30))
+        if context.args:
+            try:
+                days = int(context.args[0])
+            except ValueError:
+                days = -1
+            if not 0 <= days <= DIGEST_MAX_DAYS:
+                await update.message.reply_text(f"❌ Укажите число дней от 0 до {DIGEST_MAX_DAYS} (0 - выключить).")
+                return
+            with unit_of_work() as uow:
+                ChatService.set_digest_days(uow.session, chat_id, days)
+        else:
+            with unit_of_work() as uow:
+                days = ChatService.get_digest_days(uow.session, chat_id)
+            if days is None:
+                days = DIGEST_DEFAULT_DAYS
+
+        if days:
+            message = f"🗓 Каждое утро бот напоминает о днях рождения на {days} дн. вперед."
+        else:
+            message = "🗓 Напоминания заранее выключены. Включить: /digest 3"
+        await update.message.reply_text(message)
+        schedule_message_deletion(update, delay_seconds=30)
 
     @staticmethod
     async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -326,23 +361,21 @@ class BirthdayHandler:
     @staticmethod
     async def new_member_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Welcome new members and ask for birthday registration"""
-        for member in update.message.new_chat_members:
-            # Skip if it's a bot
-            if member.is_bot:
+        # Skip bots and look up already registered members in a single query
+        members = [member for member in update.message.new_chat_members if not member.is_bot]
+        if not members:
+            return
+
+        with unit_of_work() as uow:
+            registered = BirthdayService.get_registered_user_ids(
+                uow.session, update.message.chat_id, [member.id for member in members]
+            )
+
+        for member in members:
+            if member.id in registered:
+                # User already has birthday registered
                 continue
             
-            # Check if user already has birthday registered
-            db = SessionLocal()
-            try:
-                existing_birthday = BirthdayService.get_user_birthday(
-                    db, member.id, update.message.chat_id
-                )
-                if existing_birthday:
-                    # User already has birthday registered
-                    continue
-            finally:
-                db.close()
-            
             welcome_text = (
                 f"👋 Добро пожаловать в чат, {member.first_name}!\n\n"
                 f"🎂 Хотели бы вы зарегистрировать свой день рождения?\n"
@@ -371,7 +404,7 @@ class BirthdayHandler:
                     reply_markup=reply_markup
                 )
             except Exception as e:
-                logger.error(f"Error welcoming new member: {e}")
+                logger.error("Error welcoming new member: %s", e)
 
     @staticmethod
     async def new_member_day(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -434,13 +467,15 @@ class BirthdayHandler:
             return WAITING_FOR_MONTH
 
         # Save to database
-        db = SessionLocal()
-        try:
+        with unit_of_work() as uow:
             success, message = BirthdayService.register_birthday(
-                db, user_id, chat_id, day, month, username
+                uow.session, user_id, chat_id, day, month, username
             )
-            await query.edit_message_text(text=message)
-        finally:
-            db.close()
+        await query.edit_message_text(text=message)
 
         return ConversationHandler.END
+
+
+# Per-command latency histograms and slow-call log
+metrics.instrument_handlers(BirthdayHandler)
+profiling.instrument_slow_log(BirthdayHandler)
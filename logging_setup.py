@@ -0,0 +1,132 @@
+"""
+Queued, optionally structured logging
+
+Log calls on the event loop only create a record and put it on an
+in-memory queue; a QueueListener thread formats and writes it. Records
+are passed on unformatted, so %-style arguments are only rendered by the
+listener (and never for records that are filtered out). With
+LOG_FORMAT=json every line is one JSON object.
+
+Repetitive per-chat success logs (one per greeting sent) are marked with
+extra=SAMPLED; of those, only the first and then every LOG_SAMPLE_EVERY-th
+record of each message template is kept. Warnings and errors are never
+sampled.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import IO, Dict, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" or "json"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Write from a background thread (set to 0 to log synchronously, e.g. when debugging a crash)
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1") != "0"
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Pass as extra= to mark a record as sampled
+SAMPLED = {"sampled": True}
+
+# Attributes every LogRecord has; anything else came from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in `every` sampled records of each message template"""
+
+    def __init__(self, every: int = LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = every
+        self._seen: Dict[Tuple[str, str], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every <= 1 or not getattr(record, "sampled", False) or record.levelno > logging.INFO:
+            return True
+        key = (record.name, str(record.msg))
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % self.every:
+            return False
+        record.sample_every = self.every
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != "sampled":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue is in-process, so the record needs no pickling-safe copy
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, queued: bool = LOG_QUEUE,
+                  sample_every: int = LOG_SAMPLE_EVERY, stream: Optional[IO[str]] = None) -> None:
+    """
+    Configure the root logger, replacing any earlier configuration
+
+    Args:
+        fmt: "text" or "json"
+        queued: Write from a QueueListener thread instead of the calling thread
+        sample_every: Keep one in this many sampled records (1 = keep all)
+        stream: Destination (default stderr)
+    """
+    stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    if queued:
+        global _listener
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        handler = _LazyQueueHandler(records)
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+    # Sampling runs in the caller, so dropped records never reach the queue
+    handler.addFilter(SamplingFilter(sample_every))
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
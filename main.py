@@ -1,45 +1,120 @@
 import os
 import logging
 from dotenv import load_dotenv
+
+# Load environment variables before the project modules below read their settings at import time
+load_dotenv()
+
 from telegram.ext import (
     Application, CommandHandler, ConversationHandler, 
-    MessageHandler, CallbackQueryHandler, filters
+    MessageHandler, CallbackQueryHandler, ChatMemberHandler, TypeHandler, filters
 )
-from database import init_db
+from telegram import Update
+from database import bot_scope, current_bot_id, engine, init_db, mark_schema_current
 from handlers import BirthdayHandler, WAITING_FOR_MONTH, WAITING_FOR_DAY
 from scheduler import BirthdayScheduler
+from dispatcher import MessageDispatcher
+from digest import DigestJob
+from chat_lifecycle import DeadChatPurger, chat_migrated, my_chat_member_update
+from metrics import MetricsServer
+from profiling import profile_command, start_profiling_from_signal
+from username_refresh import USERNAME_REFRESHER
+from utils import bot_id_from_token, flush_pending_deletions
+from throttle import THROTTLE, THROTTLE_ENABLED
+from birthday_calendar import birthdays_celebrated_on, days_until_table, today
+from logging_setup import setup_logging, stop_logging
 import asyncio
+import signal
+import time
 
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Configure logging (written from a background thread; see logging_setup)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Get bot token
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN environment variable is not set")
+# Get bot tokens (BOT_TOKENS hosts several bots in one process; BOT_TOKEN is the single-bot form)
+BOT_TOKENS = [token.strip() for token in os.getenv("BOT_TOKENS", os.getenv("BOT_TOKEN", "")).split(",") if token.strip()]
+if not BOT_TOKENS:
+    raise ValueError("BOT_TOKEN (or BOT_TOKENS) environment variable is not set")
 
+# Bot API endpoint (override to run against a local Bot API server or benchmarks.fake_bot_api)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# Metrics endpoint (disabled unless a port is given)
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Time allowed to finish in-flight work after SIGTERM (keep below the supervisor's kill timeout)
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "8"))
+
+
+def warm_up():
+    """Open a pooled connection and build today's calendar tables"""
+    started = time.perf_counter()
+    with engine.connect():
+        pass
+    days_until_table(today())
+    birthdays_celebrated_on(today())
+    logger.info("Warm-up finished in %.0f ms", (time.perf_counter() - started) * 1000)
+
+
+async def drain(applications, scheduler, purger, tasks) -> None:
+    """
+    Stop taking updates and let in-flight work finish within SHUTDOWN_TIMEOUT_SECONDS
+
+    Updates already fetched are still handled and their offset is confirmed,
+    so the next instance continues where this one stopped.
+    """
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+
+    def remaining() -> float:
+        return max(deadline - time.monotonic(), 0)
+
+    # No new updates; handlers of fetched ones run to completion
+    await asyncio.gather(*(application.updater.stop() for application in applications))
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(application.stop() for application in applications)), timeout=remaining()
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Pending updates were not finished before the shutdown deadline")
+
+    # A greeting run in progress is finished; the username buffer is flushed on stop
+    scheduler.stop()
+    purger.stop()
+    USERNAME_REFRESHER.stop()
+    unfinished = set()
+    if tasks:
+        _, unfinished = await asyncio.wait(tasks, timeout=remaining())
+    for task in unfinished:
+        task.cancel()
+    if unfinished:
+        logger.warning("Cancelled %s background tasks at the shutdown deadline", len(unfinished))
+
+    # Delete scheduled command messages now instead of leaving them behind
+    not_deleted = await flush_pending_deletions(remaining())
+    if not_deleted:
+        logger.warning("%s command messages were not deleted before exit", not_deleted)
+    logger.info("Shutdown complete")
+
+
+async def set_bot_scope(update: Update, context) -> None:
+    """Make the receiving bot the current one for the rest of the update's handling"""
+    current_bot_id.set(context.bot.id)
+
+
+def build_application(token: str) -> Application:
+    """Create one bot's Application with all handlers registered"""
+    application = Application.builder().token(token).base_url(TELEGRAM_API_BASE_URL).build()
 
-async def main():
-    """Main function to start the bot"""
-    
-    # Initialize database
-    logger.info("Initializing database...")
-    init_db()
-    
-    # Create the Application
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Create scheduler
-    scheduler = BirthdayScheduler(application.bot)
-    
     # Add handlers
+    # Scopes everything done for the update (queries, cache, throttle) to this bot
+    application.add_handler(TypeHandler(Update, set_bot_scope), group=-3)
+    # Sees every update first and buffers username changes (never blocks or writes)
+    application.add_handler(TypeHandler(Update, USERNAME_REFRESHER.handle_update), group=-2)
+    # Drops commands over their per-user/per-chat limits before any handler runs
+    if THROTTLE_ENABLED:
+        application.add_handler(TypeHandler(Update, THROTTLE.handle_update), group=-1)
+
     # Basic commands
     application.add_handler(CommandHandler("start", BirthdayHandler.start_command))
     application.add_handler(CommandHandler("help", BirthdayHandler.help_command))
@@ -47,6 +122,8 @@ async def main():
     application.add_handler(CommandHandler("deletebirthday", BirthdayHandler.delete_birthday))
     application.add_handler(CommandHandler("nextbirthdays", BirthdayHandler.next_birthdays))
     application.add_handler(CommandHandler("listbirthdays", BirthdayHandler.list_birthdays))
+    application.add_handler(CommandHandler("digest", BirthdayHandler.digest_settings))
+    application.add_handler(CommandHandler("profile", profile_command))
 
     # Conversation handler for /setbirthday
     set_birthday_conv = ConversationHandler(
@@ -95,35 +172,94 @@ async def main():
     )
     application.add_handler(new_member_conv)
 
-    # Start the scheduler in a background task
+    # Chat lifecycle: bot removed/re-added, group upgraded to supergroup
+    application.add_handler(ChatMemberHandler(my_chat_member_update, ChatMemberHandler.MY_CHAT_MEMBER))
+    application.add_handler(MessageHandler(filters.StatusUpdate.MIGRATE, chat_migrated))
+    return application
+
+
+async def main():
+    """Main function to start the bot"""
+    
+    # Initialize database (skipped when the stored schema version is current)
+    if init_db():
+        logger.info("Database schema created or upgraded")
+        from migrations import add_bot_scope, create_missing_indexes, migrate_legacy_birthdays, widen_id_columns
+        widen_id_columns()
+        # Data from before multi-bot hosting belongs to the first configured bot
+        primary_bot_id = bot_id_from_token(BOT_TOKENS[0])
+        add_bot_scope(primary_bot_id)
+        create_missing_indexes()
+        # Move any rows left in the legacy per-chat table
+        with bot_scope(primary_bot_id):
+            migrate_legacy_birthdays()
+        mark_schema_current()
+    
+    # Create one Application per bot
+    applications = [build_application(token) for token in BOT_TOKENS]
+    
+    # Create scheduler (each bot's greetings and digests share one rate-limited sender)
+    dispatchers = [MessageDispatcher(application.bot) for application in applications]
+    scheduler = BirthdayScheduler(dispatchers, DigestJob())
+    purger = DeadChatPurger()
+
+    # Set by SIGTERM/SIGINT
+    stopping = asyncio.Event()
+
+    # Warm up after polling has started, then start the scheduler
     async def start_scheduler():
-        await scheduler.start()
-
-    # Run the bot
-    logger.info("Starting bot...")
-    async with application:
-        await application.initialize()
-        await application.start()
-        await application.updater.start_polling()
+        await asyncio.to_thread(warm_up)
+        if not stopping.is_set():
+            await scheduler.start()
+
+    # Run the bots
+    logger.info("Starting %s bot(s)...", len(applications))
+    started = []
+    metrics_server = None
+    try:
+        for application in applications:
+            await application.initialize()
+            started.append(application)
+            await application.start()
+            await application.updater.start_polling()
         
         # Start scheduler as background task
         scheduler_task = asyncio.create_task(start_scheduler())
-        
+        purger_task = asyncio.create_task(purger.start())
+        username_task = asyncio.create_task(USERNAME_REFRESHER.start())
+
+        # SIGUSR1 starts a sampling profile of the event loop; SIGTERM/SIGINT drain and exit
+        loop = asyncio.get_running_loop()
         try:
-            # Keep the application running
-            await asyncio.Event().wait()
-        except KeyboardInterrupt:
-            logger.info("Shutting down...")
-            scheduler.stop()
-            await scheduler_task
-        finally:
-            await application.updater.stop()
-            await application.stop()
-            await application.shutdown()
+            loop.add_signal_handler(signal.SIGUSR1, start_profiling_from_signal)
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, stopping.set)
+        except (NotImplementedError, AttributeError):
+            logger.debug("Signal handlers are not available on this platform")
 
+        if METRICS_PORT:
+            metrics_server = MetricsServer(METRICS_HOST, int(METRICS_PORT))
+            await metrics_server.start()
+        
+        # Run until SIGTERM (systemd/Docker stop) or SIGINT
+        await stopping.wait()
+        logger.info("Shutting down...")
+        await drain(applications, scheduler, purger, [scheduler_task, purger_task, username_task])
+    finally:
+        if metrics_server:
+            await metrics_server.stop()
+        for application in started:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        engine.dispose()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Bot stopped")
+    finally:
+        stop_logging()
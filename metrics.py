@@ -0,0 +1,412 @@
+"""
+Prometheus-style metrics for Birthday Reminder Bot
+
+Counters, gauges and histograms are kept in plain Python objects and
+rendered in the text exposition format on a small local HTTP endpoint.
+Updating a metric is a dict lookup and an addition, so it is cheap enough
+for handler and query hot paths. Queries also run in worker threads
+(asyncio.to_thread), so updates, label child creation and rendering
+share one lock; it is only held for a few dict and list operations.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Default latency buckets in seconds (1 ms .. 30 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Guards every metric value and _children dict (updates come from worker threads too)
+_lock = threading.Lock()
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class: a named metric with optional labels"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Return the child metric for the given label values"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with _lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        # Gauge callbacks run under the lock, so they must not update metrics themselves
+        with _lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with _lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with _lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with _lock:
+            self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception as e:
+                logger.debug("Gauge callback failed: %s", e)
+                return float("nan")
+        return self.value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._children[()].dec(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._children[()].set_function(function)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.upper_bounds, value)
+        with _lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry=None):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Write metrics to a file for node_exporter's textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+# Handlers
+HANDLER_DURATION = Histogram(
+    "birthdaybot_handler_duration_seconds", "Time spent in BirthdayHandler methods", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "birthdaybot_handler_errors_total", "BirthdayHandler calls that raised", ["handler"]
+)
+
+# Database
+DB_QUERY_DURATION = Histogram(
+    "birthdaybot_db_query_duration_seconds", "Time spent executing SQL statements", ["statement"]
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "birthdaybot_db_pool_checked_out", "Connections currently checked out of the pool"
+)
+DB_POOL_SIZE = Gauge(
+    "birthdaybot_db_pool_size", "Configured size of the connection pool"
+)
+DB_POOL_CHECKOUTS = Gauge(
+    "birthdaybot_db_pool_checkouts", "Connections returned to the pool since start"
+)
+DB_POOL_HOLD_SECONDS = Gauge(
+    "birthdaybot_db_pool_hold_seconds", "Total time connections were held out of the pool"
+)
+
+# Scheduler
+SCHEDULER_RUN_DURATION = Histogram(
+    "birthdaybot_scheduler_run_duration_seconds", "Duration of a daily greeting run",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+GREETINGS = Counter(
+    "birthdaybot_greetings_total", "Birthday greetings by result", ["result"]
+)
+SCHEDULER_LAST_RUN = Gauge(
+    "birthdaybot_scheduler_last_run_timestamp_seconds", "Unix time of the last daily run", ["bot_id"]
+)
+SCHEDULER_NEXT_RUN = Gauge(
+    "birthdaybot_scheduler_next_run_timestamp_seconds", "Unix time the next daily run is due"
+)
+SCHEDULER_LAG = Gauge(
+    "birthdaybot_scheduler_lag_seconds", "How long after its due time the last daily run started", ["bot_id"]
+)
+SCHEDULER_MISSED_DAYS = Counter(
+    "birthdaybot_scheduler_missed_days_total", "Days without a daily run (process down or suspended)", ["bot_id"]
+)
+
+# Backups
+BACKUP_DURATION = Histogram(
+    "birthdaybot_backup_duration_seconds", "Duration of database backups", ["type"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+BACKUPS = Counter(
+    "birthdaybot_backups_total", "Database backups by type and result", ["type", "result"]
+)
+
+
+def instrument_handlers(cls) -> None:
+    """Wrap every async static method of a handler class with latency tracking"""
+    for name, attr in list(vars(cls).items()):
+        if not isinstance(attr, staticmethod) or not inspect.iscoroutinefunction(attr.__func__):
+            continue
+        setattr(cls, name, staticmethod(_timed(attr.__func__, name)))
+
+
+def _timed(func, name: str):
+    duration = HANDLER_DURATION.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+# Set by callers that want to know how many statements ran within their scope
+current_query_counter: ContextVar[Optional[List[int]]] = ContextVar("current_query_counter", default=None)
+
+
+def _statement_type(statement: str) -> str:
+    verb = statement.lstrip()[:6].upper()
+    if verb in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        return verb.lower()
+    return "other"
+
+
+def instrument_engine(db_engine, pool_stats=None, pool_gauges: bool = True) -> None:
+    """Time every SQL statement of an engine and expose its pool usage (unless pool_gauges is False)"""
+    children = {kind: DB_QUERY_DURATION.labels(kind) for kind in ("select", "insert", "update", "delete", "other")}
+
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(db_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        children[_statement_type(statement)].observe(time.perf_counter() - started)
+        counter = current_query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    if not pool_gauges:
+        return
+    pool = db_engine.pool
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+    if hasattr(pool, "size"):
+        DB_POOL_SIZE.set_function(pool.size)
+    if pool_stats is not None:
+        DB_POOL_CHECKOUTS.set_function(lambda: pool_stats.snapshot()["checkouts"])
+        DB_POOL_HOLD_SECONDS.set_function(lambda: pool_stats.snapshot()["total_hold_seconds"])
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing the registry on /metrics"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9464, registry: Optional[Registry] = None):
+        self.host = host
+        self.port = port
+        self.registry = registry or REGISTRY
+        self._server = None
+
+    async def start(self) -> None:
+        """Start listening"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics endpoint listening on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        """Stop listening"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug("Metrics request failed: %s", e)
+        finally:
+            writer.close()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Data migrations run when the schema version changes
+
+- Legacy user_birthdays rows are moved to users + memberships in id
+  order, one short transaction per batch: each batch is upserted into the
+  new tables and deleted from user_birthdays in the same transaction, so
+  the migration can be interrupted and resumed at any time and can run
+  while the bot keeps serving. Where a user has different dates in
+  different chats, the most recently updated one wins.
+- Tables created before multi-bot hosting get a bot_id column (part of
+  their primary key); existing rows are assigned to the given bot.
+- User and chat id columns created as 32-bit integers are widened to
+  BIGINT (supergroup ids such as -100... and newer user ids need 64 bits).
+- Indexes added to existing tables are created (create_all only creates
+  indexes together with new tables).
+
+Usage:
+    python migrations.py --bot-id 123456789 [--batch-size 1000]
+"""
+
+import logging
+import time
+from typing import Dict
+
+from sqlalchemy import BigInteger, MetaData, func, inspect, text
+
+from database import Base, ChatSettings, ChatState, Membership, SessionLocal, User, UserBirthday, current_bot_id, engine
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_legacy_batch(db, batch_size: int = 1000) -> int:
+    """
+    Move one batch of legacy rows
+
+    Returns:
+        Number of legacy rows moved (0 when the table is empty)
+    """
+    rows = db.query(UserBirthday).order_by(UserBirthday.id).limit(batch_size).all()
+    if not rows:
+        return 0
+
+    try:
+        # Latest row per user within the batch
+        latest: Dict[int, UserBirthday] = {}
+        for row in rows:
+            current = latest.get(row.user_id)
+            if current is None or (row.updated_at or row.created_at) >= (current.updated_at or current.created_at):
+                latest[row.user_id] = row
+
+        users = {user.user_id: user for user in db.query(User).filter(User.user_id.in_(list(latest))).all()}
+        for user_id, row in latest.items():
+            row_updated = row.updated_at or row.created_at
+            user = users.get(user_id)
+            if user is None:
+                db.add(User(user_id=user_id, username=row.username, day=row.day, month=row.month,
+                            created_at=row.created_at, updated_at=row_updated))
+            elif user.updated_at is None or row_updated > user.updated_at:
+                user.day = row.day
+                user.month = row.month
+                user.username = row.username or user.username
+                user.updated_at = row_updated
+
+        # Legacy rows belong to the bot the migration runs for
+        bot_id = current_bot_id.get()
+        pairs = {(row.user_id, row.chat_id) for row in rows}
+        existing = {
+            (m.user_id, m.chat_id)
+            for m in db.query(Membership).filter(
+                Membership.bot_id == bot_id, Membership.user_id.in_(list(latest))
+            ).all()
+        }
+        for user_id, chat_id in pairs - existing:
+            db.add(Membership(bot_id=bot_id, user_id=user_id, chat_id=chat_id, opt_in=True))
+
+        db.query(UserBirthday).filter(
+            UserBirthday.id.in_([row.id for row in rows])
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(rows)
+
+
+def migrate_legacy_birthdays(batch_size: int = 1000, pause_seconds: float = 0.0) -> int:
+    """
+    Move all legacy rows to the normalized tables
+
+    Args:
+        batch_size: Legacy rows per transaction
+        pause_seconds: Sleep between batches to leave room for live traffic
+
+    Returns:
+        Total number of legacy rows moved
+    """
+    total = 0
+    db = SessionLocal()
+    try:
+        remaining = db.query(func.count(UserBirthday.id)).scalar()
+        if remaining:
+            logger.info("Migrating %s legacy birthday rows", remaining)
+        while True:
+            moved = migrate_legacy_batch(db, batch_size)
+            if not moved:
+                break
+            total += moved
+            logger.info("Migrated %s/%s legacy birthday rows", total, remaining)
+            if pause_seconds:
+                time.sleep(pause_seconds)
+    finally:
+        db.close()
+    return total
+
+
+def add_bot_scope(bot_id: int) -> None:
+    """
+    Add bot_id to tables created before multi-bot hosting
+
+    Each table lacking the column is rebuilt with the current definition
+    (bot_id leads the primary key) and its rows are copied over with the
+    given bot_id, in one transaction per table. Tables that already have
+    the column are left alone.
+    """
+    for model in (Membership, ChatState, ChatSettings):
+        table = model.__table__
+        with engine.begin() as conn:
+            inspector = inspect(conn)
+            if not inspector.has_table(table.name):
+                continue
+            old_columns = [column["name"] for column in inspector.get_columns(table.name)]
+            if "bot_id" in old_columns:
+                continue
+
+            logger.info("Adding bot_id to %s (existing rows go to bot %s)", table.name, bot_id)
+            # Index names are shared with the rebuilt table: drop the old ones first
+            for index in inspector.get_indexes(table.name):
+                conn.execute(text(f"DROP INDEX {index['name']}"))
+            # The copy lives in scratch metadata, next to the tables its foreign keys point at
+            scratch = MetaData()
+            for referred in {key.column.table for key in table.foreign_keys}:
+                referred.to_metadata(scratch)
+            rebuilt = table.to_metadata(scratch, name=f"{table.name}_rebuild")
+            rebuilt.indexes.clear()
+            rebuilt.create(conn)
+            columns = ", ".join(name for name in old_columns if name in table.columns)
+            conn.execute(
+                text(f"INSERT INTO {rebuilt.name} (bot_id, {columns}) SELECT :bot_id, {columns} FROM {table.name}"),
+                {"bot_id": bot_id},
+            )
+            conn.execute(text(f"DROP TABLE {table.name}"))
+            conn.execute(text(f"ALTER TABLE {rebuilt.name} RENAME TO {table.name}"))
+            for index in table.indexes:
+                index.create(conn)
+
+
+def widen_id_columns() -> None:
+    """
+    Alter 32-bit user/chat id columns to BIGINT
+
+    Only needed on databases with a real 32-bit INTEGER (PostgreSQL);
+    SQLite integers are already 64-bit. Runs in one transaction so the
+    memberships -> users foreign key never joins columns of different types.
+    """
+    if engine.dialect.name == "sqlite":
+        return
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for model in (Membership, ChatState, ChatSettings, User):
+            table = model.__table__
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if not isinstance(column.type, BigInteger) or column.name not in existing:
+                    continue
+                if isinstance(existing[column.name], BigInteger):
+                    continue
+                logger.info("Widening %s.%s to BIGINT", table.name, column.name)
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT"))
+
+
+def create_missing_indexes() -> None:
+    """Create indexes declared on the models but missing from existing tables"""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    logger.info("Creating index %s", index.name)
+                    index.create(conn)
+
+
+def main():
+    import argparse
+    from database import bot_scope, init_db, mark_schema_current
+
+    parser = argparse.ArgumentParser(description="Run data migrations (legacy rows, bot_id scoping)")
+    parser.add_argument("--bot-id", type=int, required=True,
+                        help="Bot that existing data belongs to (the number before ':' in its token)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    init_db()
+    widen_id_columns()
+    add_bot_scope(args.bot_id)
+    create_missing_indexes()
+    with bot_scope(args.bot_id):
+        moved = migrate_legacy_birthdays(args.batch_size, args.pause)
+    mark_schema_current()
+    print(f"Moved {moved} rows")
+
+
+if __name__ == "__main__":
+    main()
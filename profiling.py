@@ -0,0 +1,183 @@
+"""
+On-demand profiling for a running bot
+
+- SamplingProfiler samples the event loop thread's stack from a helper
+  thread for a limited time and writes collapsed stacks
+  (`frame;frame;frame count`), the input format of flamegraph.pl and
+  speedscope. Sampling backs off when it costs more than the overhead cap.
+- instrument_slow_log() logs handler calls slower than a threshold
+  together with the number of SQL statements they ran.
+"""
+
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = 300
+PROFILE_DEFAULT_SECONDS = int(os.getenv("PROFILE_DEFAULT_SECONDS", "30"))
+# Share of wall time the sampler may spend walking stacks
+PROFILE_MAX_OVERHEAD = float(os.getenv("PROFILE_MAX_OVERHEAD", "0.02"))
+SLOW_LOG_THRESHOLD_MS = float(os.getenv("SLOW_LOG_THRESHOLD_MS", "500"))
+ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if x}
+
+slow_logger = logging.getLogger("slowlog")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for one thread"""
+
+    def __init__(self, output_dir: str = PROFILE_DIR, interval: float = 0.005,
+                 max_overhead: float = PROFILE_MAX_OVERHEAD):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: int, thread_id: Optional[int] = None) -> str:
+        """
+        Start sampling in the background
+
+        Args:
+            seconds: How long to sample (capped at PROFILE_MAX_SECONDS)
+            thread_id: Thread to sample (default: the calling thread)
+
+        Returns:
+            Path of the collapsed-stack file that will be written
+        """
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile_{datetime.now():%Y%m%d_%H%M%S}.collapsed")
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(thread_id or threading.get_ident(), seconds, path),
+            name="sampling-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info("Profiling for %s s into %s", seconds, path)
+        return path
+
+    def stop(self) -> None:
+        """Stop sampling early; the file is still written"""
+        self._stop.set()
+
+    def _run(self, thread_id: int, seconds: int, path: str) -> None:
+        stacks = Counter()
+        interval = self.interval
+        started = time.perf_counter()
+        deadline = started + seconds
+        sampling_time = 0.0
+
+        while not self._stop.is_set() and time.perf_counter() < deadline:
+            sample_start = time.perf_counter()
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[";".join(reversed(labels))] += 1
+            del frame
+
+            now = time.perf_counter()
+            sampling_time += now - sample_start
+            # Hard overhead cap: halve the sampling rate whenever it is exceeded
+            if now - started >= 1.0 and sampling_time / (now - started) > self.max_overhead:
+                interval = min(interval * 2, 1.0)
+            self._stop.wait(interval)
+
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "Profile written to %s: %s samples, overhead %.2f%%",
+            path, sum(stacks.values()), sampling_time / elapsed * 100,
+        )
+
+
+PROFILER = SamplingProfiler()
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /profile [seconds] (bot operators listed in ADMIN_USER_IDS only)"""
+    if update.message.from_user.id not in ADMIN_USER_IDS:
+        return
+
+    seconds = PROFILE_DEFAULT_SECONDS
+    if context.args:
+        try:
+            seconds = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Использование: /profile [секунды]")
+            return
+
+    try:
+        path = PROFILER.start(seconds)
+    except RuntimeError:
+        await update.message.reply_text("⏳ Профилирование уже запущено.")
+        return
+    await update.message.reply_text(f"🔬 Профилирование запущено на {min(seconds, PROFILE_MAX_SECONDS)} с.: {path}")
+
+
+def start_profiling_from_signal() -> None:
+    """Signal handler: profile the event loop thread for PROFILE_DEFAULT_SECONDS"""
+    try:
+        PROFILER.start(PROFILE_DEFAULT_SECONDS)
+    except RuntimeError:
+        logger.info("Profiler is already running")
+
+
+def instrument_slow_log(cls, threshold_ms: float = SLOW_LOG_THRESHOLD_MS) -> None:
+    """Log calls of a handler class's async static methods that exceed a threshold"""
+    for name, attr in list(vars(cls).items()):
+        if not isinstance(attr, staticmethod) or not inspect.iscoroutinefunction(attr.__func__):
+            continue
+        setattr(cls, name, staticmethod(_slow_logged(attr.__func__, name, threshold_ms / 1000)))
+
+
+def _slow_logged(func, name: str, threshold: float):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        counter = [0]
+        token = metrics.current_query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.current_query_counter.reset(token)
+            if elapsed >= threshold:
+                slow_logger.warning("Slow handler %s: %.1f ms, %s queries", name, elapsed * 1000, counter[0])
+
+    return wrapper
@@ -0,0 +1,120 @@
+"""
+Per-chat cache of rendered command replies
+
+Replies such as /nextbirthdays depend only on the chat's rows and on the
+date, so an entry stays valid until local midnight or until the chat is
+written to. Concurrent requests for the same entry share one rendering
+(single-flight), which runs in a worker thread so the event loop keeps
+serving other updates. Size is bounded with LRU eviction.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Hashable, Tuple
+
+import metrics
+from birthday_calendar import today
+from database import current_bot_id
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+CACHE_REQUESTS = metrics.Counter(
+    "birthdaybot_response_cache_requests_total", "Rendered reply lookups by result", ["kind", "result"]
+)
+
+
+class _Flight:
+    """A rendering in progress"""
+    __slots__ = ("future", "stale")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.stale = False
+
+
+class RenderedResponseCache:
+    """LRU cache of rendered replies keyed by (bot_id, chat_id, kind)"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, Hashable, str], Tuple[str, date]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, Hashable, str], _Flight] = {}
+        self._kinds = set()
+        self._bot_ids = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_or_render(self, chat_id: Hashable, kind: str, render: Callable[[], str]) -> str:
+        """
+        Return the cached reply or render it once for all concurrent callers
+
+        Args:
+            chat_id: Chat the reply belongs to (of the current bot)
+            kind: Reply type, e.g. "nextbirthdays"
+            render: Blocking function producing the reply text
+
+        Returns:
+            Reply text
+        """
+        bot_id = current_bot_id.get()
+        key = (bot_id, chat_id, kind)
+        self._kinds.add(kind)
+        self._bot_ids.add(bot_id)
+        valid_for = today()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == valid_for:
+            self._entries.move_to_end(key)
+            CACHE_REQUESTS.labels(kind, "hit").inc()
+            return entry[0]
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            CACHE_REQUESTS.labels(kind, "shared").inc()
+            return await asyncio.shield(flight.future)
+
+        CACHE_REQUESTS.labels(kind, "miss").inc()
+        flight = _Flight(asyncio.get_running_loop().create_future())
+        self._inflight[key] = flight
+        try:
+            text = await asyncio.to_thread(render)
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except Exception as e:
+            flight.future.set_exception(e)
+            # Mark retrieved so an unshared failure is not reported as "never retrieved"
+            flight.future.exception()
+            raise
+        else:
+            flight.future.set_result(text)
+            # A write during rendering may not be reflected in the text: don't keep it
+            if not flight.stale:
+                self._store(key, text, valid_for)
+            return text
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key, text: str, valid_for: date) -> None:
+        self._entries[key] = (text, valid_for)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_chat(self, chat_id: Hashable) -> None:
+        """Drop every reply of a chat, for all bots (call after writing to it)"""
+        for bot_id, kind in ((bot_id, kind) for bot_id in self._bot_ids for kind in self._kinds):
+            key = (bot_id, chat_id, kind)
+            self._entries.pop(key, None)
+            flight = self._inflight.get(key)
+            if flight is not None:
+                flight.stale = True
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+RESPONSE_CACHE = RenderedResponseCache()
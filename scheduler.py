@@ -1,87 +1,164 @@
 import logging
-from telegram import Bot
-from telegram.error import TelegramError
-from database import SessionLocal
+import os
+from database import bot_scope, get_meta, set_meta, unit_of_work
 from services import BirthdayService
-from datetime import datetime
+from dispatcher import MessageDispatcher
+from digest import DigestJob
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
 import asyncio
+import time
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Local hour of the daily run, and how often the loop compares it with the wall clock
+GREETING_HOUR = int(os.getenv("GREETING_HOUR", "8"))
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "30"))
+
+
+def _last_run_key(bot_id: int) -> str:
+    return f"scheduler_last_run:{bot_id}"
+
 
 class BirthdayScheduler:
-    """Scheduler for sending daily birthday greetings"""
+    """
+    Scheduler for sending daily birthday greetings of every hosted bot
 
-    def __init__(self, bot: Bot):
-        self.bot = bot
+    The loop wakes every SCHEDULER_TICK_SECONDS and compares the wall clock
+    with each bot's last run date, persisted in the meta table. A day is run
+    once GREETING_HOUR has passed and it has not been run yet, so clock
+    changes, DST and a suspended machine only delay a run until the next
+    tick, and a restart never greets a chat twice on the same day.
+    """
+
+    def __init__(self, dispatchers: List[MessageDispatcher], digest_job: Optional[DigestJob] = None):
+        self.dispatchers = dispatchers
+        self.digest_job = digest_job
         self.running = False
+        self._wakeup = asyncio.Event()
+        self._last_run: Dict[int, Optional[date]] = {}
 
     async def start(self):
         """Start the scheduler"""
         self.running = True
+        self._last_run = await asyncio.to_thread(self.load_last_runs)
         logger.info("Birthday scheduler started")
         
         while self.running:
-            try:
-                await self.check_and_send_greetings()
-            except Exception as e:
-                logger.error(f"Error in scheduler: {e}")
-            
-            # Wait until next 8:00 AM
-            await self.wait_until_next_check()
+            now = datetime.now()
+            for dispatcher in self.dispatchers:
+                if not self.running:
+                    break
+                if self.is_due(dispatcher.bot_id, now):
+                    await self.run_day(dispatcher, now)
+            self.update_next_run(datetime.now())
+            await self.tick()
+
+    def load_last_runs(self) -> Dict[int, Optional[date]]:
+        """Last run date of every bot, from the meta table"""
+        last_runs = {}
+        for dispatcher in self.dispatchers:
+            value = get_meta(_last_run_key(dispatcher.bot_id))
+            last_runs[dispatcher.bot_id] = date.fromisoformat(value) if value else None
+        return last_runs
+
+    @staticmethod
+    def due_at(day: date) -> datetime:
+        """Local time the run of `day` becomes due"""
+        return datetime.combine(day, datetime.min.time()).replace(hour=GREETING_HOUR)
+
+    def is_due(self, bot_id: int, now: datetime) -> bool:
+        """True if today's run of the bot has not happened and its hour has passed"""
+        last_run = self._last_run.get(bot_id)
+        if last_run is not None and last_run >= now.date():
+            return False
+        return now >= self.due_at(now.date())
+
+    async def run_day(self, dispatcher: MessageDispatcher, now: datetime) -> None:
+        """Greetings and digests of today for one bot, recorded once the greetings went out"""
+        bot_id = dispatcher.bot_id
+        day = now.date()
+        metrics.SCHEDULER_LAG.labels(bot_id).set((now - self.due_at(day)).total_seconds())
 
-    async def check_and_send_greetings(self):
-        """Check for birthdays and send greetings"""
-        db = SessionLocal()
         try:
-            birthdays = BirthdayService.get_birthdays_today(db)
-            
-            if not birthdays:
-                logger.info("No birthdays today")
+            if not await self.check_and_send_greetings(dispatcher):
+                # Retried on the next tick
                 return
-
-            for chat_id, usernames in birthdays:
-                await self.send_greeting(chat_id, usernames)
-                
+            last_run = self._last_run.get(bot_id)
+            if last_run is not None and (day - last_run).days > 1:
+                # Greetings say "today", so days that passed entirely are reported rather than replayed
+                missed = (day - last_run).days - 1
+                metrics.SCHEDULER_MISSED_DAYS.labels(bot_id).inc(missed)
+                logger.warning("Bot %s missed %s daily run(s) since %s", bot_id, missed, last_run)
+            self._last_run[bot_id] = day
+            metrics.SCHEDULER_LAST_RUN.labels(bot_id).set(time.time())
+            await asyncio.to_thread(set_meta, _last_run_key(bot_id), day.isoformat())
+            if self.digest_job:
+                await self.digest_job.run(dispatcher)
         except Exception as e:
-            logger.error(f"Error checking birthdays: {e}")
-        finally:
-            db.close()
+            logger.error("Error in scheduler for bot %s: %s", bot_id, e)
 
-    async def send_greeting(self, chat_id: int, usernames: list):
-        """Send birthday greeting to a chat"""
+    def update_next_run(self, now: datetime) -> None:
+        """Export when the next run is due (the earliest over all bots)"""
+        today = now.date()
+        pending = []
+        for dispatcher in self.dispatchers:
+            last_run = self._last_run.get(dispatcher.bot_id)
+            ran_today = last_run is not None and last_run >= today
+            pending.append(self.due_at(today + timedelta(days=1) if ran_today else today))
+        if pending:
+            metrics.SCHEDULER_NEXT_RUN.set(min(pending).timestamp())
+
+    async def tick(self) -> None:
+        """Sleep one tick (cut short by stop())"""
         try:
-            if len(usernames) == 1:
-                message = f"🎉 Сегодня день рождения у {usernames[0]}! 🎂\n\nПоздравляем! 🎊"
-            else:
-                names = ", ".join(usernames)
-                message = f"🎉 Сегодня дни рождения у {names}! 🎂\n\nПоздравляем! 🎊"
-
-            await self.bot.send_message(chat_id=chat_id, text=message)
-            logger.info(f"Birthday greeting sent to chat {chat_id}")
-        except TelegramError as e:
-            logger.error(f"Error sending message to chat {chat_id}: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error sending greeting: {e}")
+            await asyncio.wait_for(self._wakeup.wait(), timeout=SCHEDULER_TICK_SECONDS)
+        except asyncio.TimeoutError:
+            pass
 
-    async def wait_until_next_check(self):
-        """Wait until next check time (8:00 AM)"""
-        now = datetime.now()
-        
-        # Calculate next 8:00 AM
-        next_check = now.replace(hour=8, minute=0, second=0, microsecond=0)
-        
-        # If it's already past 8:00 AM today, schedule for tomorrow
-        if now >= next_check:
-            from datetime import timedelta
-            next_check = next_check + timedelta(days=1)
-        
-        wait_seconds = (next_check - now).total_seconds()
-        
-        logger.info(f"Next birthday check scheduled for {next_check}")
-        await asyncio.sleep(wait_seconds)
+    async def check_and_send_greetings(self, dispatcher: MessageDispatcher) -> bool:
+        """
+        Check for birthdays and send greetings in the chats of one bot
+
+        Returns:
+            False if today's birthdays could not be read (nothing was sent)
+        """
+        started = time.perf_counter()
+        try:
+            try:
+                # Release the connection before sending anything
+                with bot_scope(dispatcher.bot_id), unit_of_work() as uow:
+                    birthdays = BirthdayService.get_birthdays_today(uow.session)
+            except Exception as e:
+                logger.error("Error checking birthdays: %s", e)
+                return False
+            
+            if not birthdays:
+                logger.info("No birthdays today for bot %s", dispatcher.bot_id)
+                return True
+
+            sent, failed = await dispatcher.send_many(
+                ((chat_id, self.greeting_text(usernames)) for chat_id, usernames in birthdays), "greeting"
+            )
+            metrics.GREETINGS.labels("sent").inc(sent)
+            metrics.GREETINGS.labels("failed").inc(failed)
+            logger.info("Birthday greetings sent to %s chats (%s failed)", sent, failed)
+            return True
+        finally:
+            metrics.SCHEDULER_RUN_DURATION.observe(time.perf_counter() - started)
+
+    @staticmethod
+    def greeting_text(usernames: list) -> str:
+        """Greeting message for one chat"""
+        if len(usernames) == 1:
+            return f"🎉 Сегодня день рождения у {usernames[0]}! 🎂\n\nПоздравляем! 🎊"
+        names = ", ".join(usernames)
+        return f"🎉 Сегодня дни рождения у {names}! 🎂\n\nПоздравляем! 🎊"
 
     def stop(self):
-        """Stop the scheduler"""
+        """Stop the scheduler (a greeting run in progress is finished first)"""
         self.running = False
+        self._wakeup.set()
         logger.info("Birthday scheduler stopped")
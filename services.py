@@ -1,8 +1,14 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from database import UserBirthday
-from datetime import datetime
-from typing import List, Optional, Tuple
+from sqlalchemy import and_, or_, select
+from database import ChatSettings, ChatState, Membership, User, current_bot_id, no_index, read_only, replica_pins
+from birthday_calendar import birthdays_celebrated_on, days_until_table, today
+from response_cache import RESPONSE_CACHE
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+
+def _display_name(user_id: int, username: Optional[str]) -> str:
+    return username or f"User {user_id}"
 
 
 class BirthdayService:
@@ -11,8 +17,11 @@ class BirthdayService:
     @staticmethod
     def register_birthday(db: Session, user_id: int, chat_id: int, day: int, month: int, username: Optional[str] = None) -> Tuple[bool, str]:
         """
-        Register or update a user's birthday for a specific chat
-        
+        Register or update a user's birthday and opt in to a specific chat
+
+        The birthday is stored once per user, so an update applies to every
+        chat the user is registered in.
+
         Args:
             db: Database session
             user_id: Telegram user ID
@@ -20,55 +29,81 @@ class BirthdayService:
             day: Day of month
             month: Month
             username: Optional username for greeting
-        
+
         Returns:
             Tuple of (success, message)
         """
         try:
-            existing = db.query(UserBirthday).filter(
-                and_(UserBirthday.user_id == user_id, UserBirthday.chat_id == chat_id)
-            ).first()
-
-            if existing:
-                existing.day = day
-                existing.month = month
-                existing.username = username
-                existing.updated_at = datetime.utcnow()
-                db.commit()
-                return True, f"✅ День рождения обновлен: {day:02d}.{month:02d}"
+            bot_id = current_bot_id.get()
+            user = db.get(User, user_id)
+            membership = db.get(Membership, (bot_id, user_id, chat_id))
+            updated = membership is not None and membership.opt_in
+
+            if user:
+                user.day = day
+                user.month = month
+                if username:
+                    user.username = username
+                user.updated_at = datetime.utcnow()
             else:
-                birthday = UserBirthday(
-                    user_id=user_id,
-                    chat_id=chat_id,
-                    day=day,
-                    month=month,
-                    username=username
-                )
-                db.add(birthday)
-                db.commit()
-                return True, f"✅ День рождения зарегистрирован: {day:02d}.{month:02d}"
+                db.add(User(user_id=user_id, username=username, day=day, month=month))
+
+            if membership:
+                membership.opt_in = True
+            else:
+                db.add(Membership(bot_id=bot_id, user_id=user_id, chat_id=chat_id, opt_in=True))
+            db.commit()
+
+            # The date is shown in every chat of the user
+            for affected_chat_id in BirthdayService.get_user_chat_ids(db, user_id):
+                RESPONSE_CACHE.invalidate_chat(affected_chat_id)
+
+            if updated:
+                return True, f"✅ День рождения обновлен: {day:02d}.{month:02d}"
+            return True, f"✅ День рождения зарегистрирован: {day:02d}.{month:02d}"
         except Exception as e:
             db.rollback()
             return False, f"❌ Ошибка при сохранении: {str(e)}"
 
     @staticmethod
-    def get_user_birthday(db: Session, user_id: int, chat_id: int) -> Optional[UserBirthday]:
-        """Get user's birthday for a specific chat"""
-        return db.query(UserBirthday).filter(
-            and_(UserBirthday.user_id == user_id, UserBirthday.chat_id == chat_id)
+    def get_user_chat_ids(db: Session, user_id: int) -> List[int]:
+        """Chats in which a user is registered, with any bot (the date is shared by all of them)"""
+        rows = db.query(Membership.chat_id).filter(
+            and_(Membership.user_id == user_id, Membership.opt_in.is_(True))
+        ).distinct().all()
+        return [row.chat_id for row in rows]
+
+    @staticmethod
+    @read_only
+    def get_user_birthday(db: Session, user_id: int, chat_id: int) -> Optional[User]:
+        """Get user's birthday if the user is registered in a specific chat"""
+        return db.query(User).join(Membership, Membership.user_id == User.user_id).filter(
+            and_(Membership.bot_id == current_bot_id.get(), Membership.user_id == user_id,
+                 Membership.chat_id == chat_id, Membership.opt_in.is_(True))
         ).first()
 
+    @staticmethod
+    @read_only
+    def get_registered_user_ids(db: Session, chat_id: int, user_ids: List[int]) -> Set[int]:
+        """Return which of the given users have a birthday registered in a chat"""
+        if not user_ids:
+            return set()
+        rows = db.query(Membership.user_id).filter(
+            and_(Membership.bot_id == current_bot_id.get(), Membership.chat_id == chat_id,
+                 Membership.user_id.in_(user_ids), Membership.opt_in.is_(True))
+        ).all()
+        return {row.user_id for row in rows}
+
     @staticmethod
     def delete_birthday(db: Session, user_id: int, chat_id: int) -> Tuple[bool, str]:
-        """Delete user's birthday for a specific chat"""
+        """Opt a user out of a specific chat"""
         try:
-            birthday = db.query(UserBirthday).filter(
-                and_(UserBirthday.user_id == user_id, UserBirthday.chat_id == chat_id)
-            ).first()
+            membership = db.get(Membership, (current_bot_id.get(), user_id, chat_id))
 
-            if birthday:
-                db.delete(birthday)
+            if membership and membership.opt_in:
+                membership.opt_in = False
                 db.commit()
+                RESPONSE_CACHE.invalidate_chat(chat_id)
                 return True, "✅ Ваши данные удалены из этого чата"
             else:
                 return False, "❌ Данные не найдены"
@@ -77,79 +112,217 @@ class BirthdayService:
             return False, f"❌ Ошибка при удалении: {str(e)}"
 
     @staticmethod
+    @read_only
     def get_birthdays_today(db: Session) -> List[Tuple[int, List[str]]]:
         """
         Get all birthdays for today grouped by chat
-        
+
         Returns:
             List of tuples: (chat_id, [usernames])
         """
-        from utils import is_birthday_today
-        
-        today = datetime.now().date()
-        birthdays = db.query(UserBirthday).filter(
-            and_(UserBirthday.day == today.day, UserBirthday.month == today.month)
+        # 29.02 birthdays are celebrated on 28.02 or 01.03 in non-leap years
+        dates = birthdays_celebrated_on(today())
+        # Skip chats the bot was removed from (primary key lookup in chat_states)
+        bot_id = current_bot_id.get()
+        dead_chats = select(ChatState.chat_id).where(ChatState.bot_id == bot_id)
+        rows = db.query(Membership.chat_id, User.user_id, User.username).join(
+            Membership, Membership.user_id == User.user_id
+        ).filter(
+            or_(*(and_(User.day == day, User.month == month) for day, month in dates)),
+            no_index(Membership.bot_id) == bot_id,
+            Membership.opt_in.is_(True),
+            Membership.chat_id.not_in(dead_chats),
         ).all()
 
-        # Group by chat_id
+        # Group by chat_id (no ORDER BY, so the query is driven by the users (month, day) index)
         chats_dict = {}
-        for birthday in birthdays:
-            if birthday.chat_id not in chats_dict:
-                chats_dict[birthday.chat_id] = []
-            username = birthday.username or f"User {birthday.user_id}"
-            chats_dict[birthday.chat_id].append(username)
+        for row in rows:
+            chats_dict.setdefault(row.chat_id, []).append(_display_name(row.user_id, row.username))
 
         return list(chats_dict.items())
 
     @staticmethod
+    def _chat_rows(db: Session, chat_id: int):
+        return db.query(User.user_id, User.username, User.day, User.month).join(
+            Membership, Membership.user_id == User.user_id
+        ).filter(
+            and_(Membership.bot_id == current_bot_id.get(), Membership.chat_id == chat_id, Membership.opt_in.is_(True))
+        ).all()
+
+    @staticmethod
+    @read_only
     def get_upcoming_birthdays(db: Session, chat_id: int, days_ahead: int = 7) -> List[Tuple[str, int, int]]:
         """
         Get upcoming birthdays in a chat
-        
+
         Args:
             db: Database session
             chat_id: Chat ID
             days_ahead: Number of days to look ahead
-        
+
         Returns:
             List of tuples: (username, day, month, days_until)
         """
-        from utils import get_days_until_birthday
-        
-        birthdays = db.query(UserBirthday).filter(UserBirthday.chat_id == chat_id).all()
-        
+        birthdays = BirthdayService._chat_rows(db, chat_id)
+
+        # One table lookup per row for the whole chat
+        table = days_until_table(today())
+        days = table.days_until_many((birthday.day, birthday.month) for birthday in birthdays)
+
         upcoming = []
-        for birthday in birthdays:
-            days_until = get_days_until_birthday(birthday.day, birthday.month)
+        for birthday, days_until in zip(birthdays, days):
             if 0 <= days_until <= days_ahead:
-                username = birthday.username or f"User {birthday.user_id}"
+                username = _display_name(birthday.user_id, birthday.username)
                 upcoming.append((username, birthday.day, birthday.month, days_until))
-        
+
         # Sort by days_until
         return sorted(upcoming, key=lambda x: x[3])
 
     @staticmethod
+    @read_only
     def get_all_chat_birthdays(db: Session, chat_id: int) -> List[Tuple[str, int, int]]:
         """
         Get all birthdays in a chat (for admin listing)
-        
+
         Args:
             db: Database session
             chat_id: Chat ID
-        
+
         Returns:
             List of tuples: (username, day, month)
         """
-        birthdays = db.query(UserBirthday).filter(UserBirthday.chat_id == chat_id).all()
-        
-        result = []
-        for birthday in birthdays:
-            username = birthday.username or f"User {birthday.user_id}"
-            result.append((username, birthday.day, birthday.month))
-        
-        return result
+        return [
+            (_display_name(birthday.user_id, birthday.username), birthday.day, birthday.month)
+            for birthday in BirthdayService._chat_rows(db, chat_id)
+        ]
 
     @staticmethod
+    @read_only
     def count_birthdays_in_chat(db: Session, chat_id: int) -> int:
         """Count number of registered birthdays in a chat"""
-        return db.query(UserBirthday).filter(UserBirthday.chat_id == chat_id).count()
+        return db.query(Membership).filter(
+            and_(Membership.bot_id == current_bot_id.get(), Membership.chat_id == chat_id, Membership.opt_in.is_(True))
+        ).count()
+
+
+class ChatService:
+    """Service for tracking chats the bot can no longer write to"""
+
+    @staticmethod
+    def mark_inactive(db: Session, chat_id: int, reason: str) -> None:
+        """Exclude a chat from greetings; its memberships are purged after a grace period"""
+        bot_id = current_bot_id.get()
+        state = db.get(ChatState, (bot_id, chat_id))
+        if state is None:
+            db.add(ChatState(bot_id=bot_id, chat_id=chat_id, status="inactive", reason=reason))
+        elif state.status != "inactive":
+            state.status = "inactive"
+            state.reason = reason
+            state.migrated_to = None
+        db.commit()
+
+    @staticmethod
+    def reactivate(db: Session, chat_id: int) -> bool:
+        """
+        Mark a chat as active again (e.g. the bot was re-added)
+
+        Returns:
+            True if the chat was inactive
+        """
+        state = db.get(ChatState, (current_bot_id.get(), chat_id))
+        if state is None:
+            return False
+        db.delete(state)
+        db.commit()
+        return True
+
+    @staticmethod
+    def migrate_chat(db: Session, old_chat_id: int, new_chat_id: int) -> int:
+        """
+        Move a group's memberships to its new supergroup id
+
+        Users who already have a membership in the new chat keep it.
+
+        Returns:
+            Number of memberships moved
+        """
+        try:
+            bot_id = current_bot_id.get()
+            already_there = select(Membership.user_id).where(
+                and_(Membership.bot_id == bot_id, Membership.chat_id == new_chat_id)
+            )
+            db.query(Membership).filter(
+                and_(Membership.bot_id == bot_id, Membership.chat_id == old_chat_id,
+                     Membership.user_id.in_(already_there))
+            ).delete(synchronize_session=False)
+            moved = db.query(Membership).filter(
+                and_(Membership.bot_id == bot_id, Membership.chat_id == old_chat_id)
+            ).update({Membership.chat_id: new_chat_id}, synchronize_session=False)
+
+            state = db.get(ChatState, (bot_id, old_chat_id))
+            if state is None:
+                db.add(ChatState(bot_id=bot_id, chat_id=old_chat_id, status="migrated", migrated_to=new_chat_id))
+            else:
+                state.status = "migrated"
+                state.migrated_to = new_chat_id
+            new_state = db.get(ChatState, (bot_id, new_chat_id))
+            if new_state is not None:
+                db.delete(new_state)
+            settings = db.get(ChatSettings, (bot_id, old_chat_id))
+            if settings is not None and db.get(ChatSettings, (bot_id, new_chat_id)) is None:
+                db.add(ChatSettings(bot_id=bot_id, chat_id=new_chat_id, digest_days=settings.digest_days))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        replica_pins.pin(chat_id=new_chat_id)
+        RESPONSE_CACHE.invalidate_chat(old_chat_id)
+        RESPONSE_CACHE.invalidate_chat(new_chat_id)
+        return moved
+
+    @staticmethod
+    @read_only
+    def get_digest_days(db: Session, chat_id: int) -> Optional[int]:
+        """Digest lead time set for a chat (None if the chat uses the default)"""
+        settings = db.get(ChatSettings, (current_bot_id.get(), chat_id))
+        return settings.digest_days if settings else None
+
+    @staticmethod
+    def set_digest_days(db: Session, chat_id: int, days: int) -> None:
+        """Set a chat's digest lead time (0 turns the digest off)"""
+        bot_id = current_bot_id.get()
+        settings = db.get(ChatSettings, (bot_id, chat_id))
+        if settings is None:
+            db.add(ChatSettings(bot_id=bot_id, chat_id=chat_id, digest_days=days))
+        else:
+            settings.digest_days = days
+        db.commit()
+
+    @staticmethod
+    def purge_inactive_batch(db: Session, grace: timedelta, batch_size: int = 500) -> int:
+        """
+        Delete one batch of memberships of chats inactive for longer than grace
+
+        Covers the chats of every bot.
+
+        Returns:
+            Number of memberships deleted (0 when nothing is left)
+        """
+        cutoff = datetime.utcnow() - grace
+        rows = db.query(Membership.bot_id, Membership.chat_id, Membership.user_id).join(
+            ChatState, and_(ChatState.bot_id == Membership.bot_id, ChatState.chat_id == Membership.chat_id)
+        ).filter(
+            and_(ChatState.status == "inactive", ChatState.updated_at <= cutoff)
+        ).limit(batch_size).all()
+        if not rows:
+            return 0
+
+        by_chat = {}
+        for row in rows:
+            by_chat.setdefault((row.bot_id, row.chat_id), []).append(row.user_id)
+        for (bot_id, chat_id), user_ids in by_chat.items():
+            db.query(Membership).filter(
+                and_(Membership.bot_id == bot_id, Membership.chat_id == chat_id, Membership.user_id.in_(user_ids))
+            ).delete(synchronize_session=False)
+        db.commit()
+        return len(rows)
@@ -0,0 +1,177 @@
+"""
+Per-user and per-chat throttling of bot commands
+
+Every command with a limit spends one token from the sender's bucket and
+one from the chat's bucket; buckets refill continuously up to their
+burst size. A command arriving with either bucket empty is dropped
+before any handler (and so any database query or reply) runs. Bucket
+state is kept in memory, bounded by LRU eviction: an evicted bucket
+simply starts full again.
+
+Limits are "burst/seconds" (e.g. 3/30: three calls at once, then one
+every ten seconds) and can be overridden per command:
+
+    THROTTLE_USER_LIMITS=nextbirthdays=3/30,listbirthdays=2/60
+    THROTTLE_CHAT_LIMITS=nextbirthdays=10/30
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# command -> (burst, seconds)
+DEFAULT_USER_LIMITS: Dict[str, Tuple[float, float]] = {
+    "nextbirthdays": (3, 30),
+    "listbirthdays": (2, 60),
+    "setbirthday": (5, 60),
+    "updatebirthday": (5, 60),
+    "mybirthday": (5, 60),
+    "deletebirthday": (3, 60),
+    "digest": (3, 60),
+}
+DEFAULT_CHAT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "nextbirthdays": (10, 60),
+    "listbirthdays": (5, 60),
+    "setbirthday": (30, 60),
+    "updatebirthday": (30, 60),
+}
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1") != "0"
+THROTTLE_MAX_BUCKETS = int(os.getenv("THROTTLE_MAX_BUCKETS", "50000"))
+
+THROTTLED_COMMANDS = metrics.Counter(
+    "birthdaybot_throttle_decisions_total", "Throttled commands by result", ["command", "result"]
+)
+THROTTLE_BUCKETS = metrics.Gauge(
+    "birthdaybot_throttle_buckets", "Token buckets held in memory"
+)
+
+
+def parse_limits(spec: Optional[str], defaults: Dict[str, Tuple[float, float]]) -> Dict[str, Tuple[float, float]]:
+    """Merge "command=burst/seconds,..." overrides into the defaults"""
+    limits = dict(defaults)
+    if not spec:
+        return limits
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            command, value = item.split("=", 1)
+            burst, seconds = value.split("/", 1)
+            limits[command.strip().lstrip("/")] = (float(burst), float(seconds))
+        except ValueError:
+            logger.warning("Ignoring malformed throttle limit: %r", item)
+    return limits
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at burst/seconds tokens per second"""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, burst: float, seconds: float, now: float):
+        self.capacity = burst
+        self.rate = burst / seconds
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class CommandThrottle:
+    """Token buckets per (bot, user, command) and (bot, chat, command), LRU-bounded"""
+
+    def __init__(self, user_limits: Dict[str, Tuple[float, float]], chat_limits: Dict[str, Tuple[float, float]],
+                 max_buckets: int = THROTTLE_MAX_BUCKETS, clock=time.monotonic):
+        self.user_limits = user_limits
+        self.chat_limits = chat_limits
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self._buckets: "OrderedDict[Tuple[str, int, int, str], TokenBucket]" = OrderedDict()
+        THROTTLE_BUCKETS.set_function(lambda: len(self._buckets))
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _bucket(self, scope: str, bot_id: int, key: int, command: str, limit: Tuple[float, float],
+                now: float) -> TokenBucket:
+        bucket_key = (scope, bot_id, key, command)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(limit[0], limit[1], now)
+            self._buckets[bucket_key] = bucket
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(bucket_key)
+            bucket.refill(now)
+        return bucket
+
+    def allow(self, command: str, user_id: Optional[int], chat_id: Optional[int], bot_id: int = 0) -> Optional[str]:
+        """
+        Spend a token for a command (each bot has its own buckets)
+
+        Returns:
+            None if the command may run, else the scope that refused it ("user" or "chat")
+        """
+        now = self.clock()
+        buckets = []
+        user_limit = self.user_limits.get(command)
+        if user_limit and user_id is not None:
+            bucket = self._bucket("user", bot_id, user_id, command, user_limit, now)
+            if bucket.tokens < 1:
+                return "user"
+            buckets.append(bucket)
+        chat_limit = self.chat_limits.get(command)
+        if chat_limit and chat_id is not None:
+            bucket = self._bucket("chat", bot_id, chat_id, command, chat_limit, now)
+            if bucket.tokens < 1:
+                return "chat"
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return None
+
+    async def handle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Update handler run before the command handlers; stops over-limit commands"""
+        command = _command_of(update)
+        if command is None or (command not in self.user_limits and command not in self.chat_limits):
+            return
+        user = update.effective_user
+        chat = update.effective_chat
+        refused = self.allow(command, user.id if user else None, chat.id if chat else None, context.bot.id)
+        if refused is None:
+            THROTTLED_COMMANDS.labels(command, "allowed").inc()
+            return
+        THROTTLED_COMMANDS.labels(command, f"dropped_{refused}").inc()
+        logger.debug("Dropped /%s from user %s in chat %s",
+                     command, user.id if user else None, chat.id if chat else None)
+        raise ApplicationHandlerStop
+
+
+def _command_of(update: Update) -> Optional[str]:
+    """Command name of a message such as "/nextbirthdays@BirthdayBot", else None"""
+    message = update.message
+    if message is None or not message.text or not message.text.startswith("/"):
+        return None
+    words = message.text[1:].split(maxsplit=1)
+    if not words:
+        return None
+    return words[0].split("@", 1)[0].lower()
+
+
+THROTTLE = CommandThrottle(
+    parse_limits(os.getenv("THROTTLE_USER_LIMITS"), DEFAULT_USER_LIMITS),
+    parse_limits(os.getenv("THROTTLE_CHAT_LIMITS"), DEFAULT_CHAT_LIMITS),
+)
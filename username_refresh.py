@@ -0,0 +1,141 @@
+"""
+Write-behind refresh of stored usernames
+
+Greetings and listings show the username captured at registration. An
+update handler in an early group notes the sender's current username on
+every update; changes are coalesced per user in memory and written by a
+background task in one batched UPDATE per interval, so handlers never
+write and each changed user costs at most one write per interval.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import bindparam, update
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import metrics
+from database import Membership, User, unit_of_work
+from response_cache import RESPONSE_CACHE
+
+logger = logging.getLogger(__name__)
+
+USERNAME_FLUSH_INTERVAL_SECONDS = float(os.getenv("USERNAME_FLUSH_INTERVAL_SECONDS", "60"))
+USERNAME_SEEN_MAX_ENTRIES = int(os.getenv("USERNAME_SEEN_MAX_ENTRIES", "100000"))
+
+USERNAMES_BUFFERED = metrics.Counter(
+    "birthdaybot_username_changes_buffered_total", "Username changes noticed in incoming updates"
+)
+USERNAMES_WRITTEN = metrics.Counter(
+    "birthdaybot_usernames_written_total", "Stored usernames updated by the write-behind flush"
+)
+USERNAMES_PENDING = metrics.Gauge(
+    "birthdaybot_usernames_pending", "Username changes waiting for the next flush"
+)
+
+
+class UsernameRefresher:
+    """Buffers username changes and flushes them periodically"""
+
+    def __init__(self, interval_seconds: float = USERNAME_FLUSH_INTERVAL_SECONDS,
+                 seen_max_entries: int = USERNAME_SEEN_MAX_ENTRIES):
+        self.interval_seconds = interval_seconds
+        self.seen_max_entries = seen_max_entries
+        self.running = False
+        self._pending: Dict[int, str] = {}
+        # Last username seen per user (LRU), so unchanged names are not re-buffered
+        self._seen: "OrderedDict[int, str]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        USERNAMES_PENDING.set_function(lambda: len(self._pending))
+
+    def observe(self, user_id: int, username: str) -> None:
+        """Note the current username of a user (cheap, no I/O)"""
+        if self._seen.get(user_id) == username:
+            self._seen.move_to_end(user_id)
+            return
+        self._seen[user_id] = username
+        self._seen.move_to_end(user_id)
+        while len(self._seen) > self.seen_max_entries:
+            self._seen.popitem(last=False)
+        if self._pending.get(user_id) != username:
+            self._pending[user_id] = username
+            USERNAMES_BUFFERED.inc()
+
+    async def handle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Update handler: record the sender's username"""
+        user = update.effective_user
+        if user is not None and user.username:
+            self.observe(user.id, user.username)
+
+    async def start(self) -> None:
+        """Flush buffered changes every interval until stopped"""
+        self.running = True
+        while self.running:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Error flushing usernames: %s", e)
+
+    async def flush(self) -> int:
+        """
+        Write all buffered changes
+
+        Returns:
+            Number of stored usernames that changed
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            changed, chat_ids = await asyncio.to_thread(_write_usernames, pending)
+        except Exception:
+            # Keep the changes for the next flush unless newer ones arrived meanwhile
+            for user_id, username in pending.items():
+                self._pending.setdefault(user_id, username)
+            raise
+        for chat_id in chat_ids:
+            RESPONSE_CACHE.invalidate_chat(chat_id)
+        if changed:
+            USERNAMES_WRITTEN.inc(changed)
+            logger.info("Refreshed %s usernames", changed)
+        return changed
+
+    def stop(self) -> None:
+        """Stop after flushing what is buffered"""
+        self.running = False
+        self._wakeup.set()
+
+
+def _write_usernames(pending: Dict[int, str]) -> Tuple[int, List[int]]:
+    """Update registered users whose username differs; return (count, affected chat ids)"""
+    with unit_of_work() as uow:
+        db = uow.session
+        rows = db.query(User.user_id, User.username).filter(User.user_id.in_(list(pending))).all()
+        changes = [
+            {"uid": row.user_id, "uname": pending[row.user_id]}
+            for row in rows if row.username != pending[row.user_id]
+        ]
+        if not changes:
+            return 0, []
+        db.execute(
+            update(User.__table__).where(User.__table__.c.user_id == bindparam("uid")).values(
+                username=bindparam("uname")
+            ),
+            changes,
+        )
+        chat_rows = db.query(Membership.chat_id).filter(
+            Membership.user_id.in_([change["uid"] for change in changes]),
+            Membership.opt_in.is_(True),
+        ).distinct().all()
+    return len(changes), [row.chat_id for row in chat_rows]
+
+
+USERNAME_REFRESHER = UsernameRefresher()
@@ -1,5 +1,5 @@
-from datetime import datetime
-from typing import Tuple, Optional
+from birthday_calendar import days_until_table, today
+from typing import Set, Tuple, Optional
 import asyncio
 from telegram import Update
 from telegram.error import TelegramError
@@ -7,6 +7,15 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Delayed deletions still waiting; flush_pending_deletions() runs them early on shutdown
+_pending_deletions: Set[asyncio.Task] = set()
+_delete_now = asyncio.Event()
+
+
+def bot_id_from_token(token: str) -> int:
+    """Numeric bot id, the part of a bot token before the colon"""
+    return int(token.split(":", 1)[0])
+
 
 def validate_date(day: int, month: int) -> Tuple[bool, str]:
     """
@@ -73,20 +82,12 @@ def get_days_until_birthday(day: int, month: int) -> int:
     Returns:
         Number of days until next birthday (0-365)
     """
-    today = datetime.now().date()
-    this_year_birthday = datetime(today.year, month, day).date()
-    
-    if this_year_birthday >= today:
-        return (this_year_birthday - today).days
-    else:
-        next_year_birthday = datetime(today.year + 1, month, day).date()
-        return (next_year_birthday - today).days
+    return days_until_table(today()).days_until(day, month)
 
 
 def is_birthday_today(day: int, month: int) -> bool:
     """Check if given date is today"""
-    today = datetime.now().date()
-    return today.day == day and today.month == month
+    return days_until_table(today()).is_today(day, month)
 
 
 async def delete_message_after_delay(update: Update, delay_seconds: int = 30) -> None:
@@ -104,11 +105,37 @@ async def delete_message_after_delay(update: Update, delay_seconds: int = 30) ->
         
         # Try to get chat info to check if bot is admin
         if update.message.chat.type in ['group', 'supergroup']:
-            await asyncio.sleep(delay_seconds)
+            try:
+                await asyncio.wait_for(_delete_now.wait(), timeout=delay_seconds)
+            except asyncio.TimeoutError:
+                pass
             await update.get_bot().delete_message(chat_id=chat_id, message_id=message_id)
-            logger.debug(f"Deleted command message {message_id} from chat {chat_id}")
+            logger.debug("Deleted command message %s from chat %s", message_id, chat_id)
     except TelegramError as e:
         # Bot might not have permission to delete messages
-        logger.debug(f"Cannot delete message: {e}")
+        logger.debug("Cannot delete message: %s", e)
     except Exception as e:
-        logger.error(f"Error deleting message: {e}")
+        logger.error("Error deleting message: %s", e)
+
+
+def schedule_message_deletion(update: Update, delay_seconds: int = 30) -> None:
+    """Delete a command message in the background after a delay"""
+    task = asyncio.create_task(delete_message_after_delay(update, delay_seconds))
+    _pending_deletions.add(task)
+    task.add_done_callback(_pending_deletions.discard)
+
+
+async def flush_pending_deletions(timeout: float) -> int:
+    """
+    Run all scheduled deletions now and wait for them (used on shutdown)
+
+    Returns:
+        Number of deletions that did not finish within the timeout
+    """
+    _delete_now.set()
+    if not _pending_deletions:
+        return 0
+    _, pending = await asyncio.wait(set(_pending_deletions), timeout=max(timeout, 0))
+    for task in pending:
+        task.cancel()
+    return len(pending)